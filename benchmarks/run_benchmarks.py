@@ -0,0 +1,218 @@
+"""Time and memory-profile the local pipeline stages on synthetic scenes of
+growing size (see synthetic_terrain.py), and write the results as JSON so
+runs can be compared to catch regressions.
+
+Each stage is run repeat times for timing, then once more under tracemalloc
+for its peak memory; tracing slows Python-heavy stages, so the traced run is
+not timed. Peak memory covers numpy arrays and Python objects, but not memory
+allocated inside compiled extensions, such as scipy's KD-trees.
+
+Usage:
+  python benchmarks/run_benchmarks.py --sizes 512 1024 2048 --output out.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for project in ['big-wall-prediction', 'mountain-slicer', 'slope-finder']:
+  sys.path.insert(0, os.path.join(HERE, '..', project))
+
+from compiled_model import CompiledModel, flatten_trees, save_model
+from grad_descent import grad_descent
+from instrumentation import max_rss_mb
+from local_cliffs import get_cliffs, get_cliffs_tiled
+from local_contours import smooth_dem, summit_contours
+from local_fractal import contour_stats
+from local_landsat import set_landsat_data
+from local_mp_score import MPIndex, set_mp_score
+from local_rasters import set_lithology, set_population
+from local_roads import RoadIndex, set_road_within_distance
+from raster_io import Raster
+from scoring import top_k
+from synthetic_terrain import make_scene
+from terrain_layers import build_layers
+
+SIZES = [512, 1024, 2048]
+SEED = 0
+CONTOUR_WINDOW = 512  # side of the window around the summit, in pixels
+CONTOUR_INTERVAL = 10  # in meters
+NUM_SEEDS = 1000  # gradient descent paths
+NUM_TREES, TREE_DEPTH = 10, 5  # as in run_xgb()
+
+
+def measure(function, repeat=1):
+  """Run function repeat times, then once more under tracemalloc. Returns
+  its last result, the best time in seconds, and the peak traced memory in
+  megabytes."""
+  seconds = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    seconds.append(time.perf_counter() - start)
+  tracemalloc.start()
+  result = function()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return result, min(seconds), peak / 2 ** 20
+
+
+def random_trees(num_features, rng):
+  """Dumps of complete random trees, in the JSON format of xgboost."""
+  dumps = []
+  for _ in range(NUM_TREES):
+    def node(nodeid, depth):
+      if depth == TREE_DEPTH:
+        return {'nodeid': nodeid, 'leaf': float(rng.normal(0, 0.1))}
+      yes, no = 2 * nodeid + 1, 2 * nodeid + 2
+      return {'nodeid': nodeid, 'split': 'f' + str(rng.integers(num_features)),
+              'split_condition': float(rng.random()), 'yes': yes, 'no': no,
+              'missing': yes,
+              'children': [node(yes, depth + 1), node(no, depth + 1)]}
+    dumps.append(json.dumps(node(0, 0)))
+  return dumps
+
+
+def planted_walls_found(walls, cliffs):
+  """Count planted walls with a cliff at least as tall centered on them."""
+  found = 0
+  for wall in walls.itertuples():
+    distance = np.hypot(cliffs.latitude - wall.latitude,
+                        cliffs.longitude - wall.longitude)
+    found += bool(((distance < wall.half_diagonal) &
+                   (cliffs.height >= wall.height)).any())
+  return found
+
+
+def run_size(size, repeat, tmp_dir):
+  """Benchmark every stage on one scene. Returns a list of records."""
+  scene = make_scene(size, SEED)
+  dem, west, north, res = scene.dem, scene.west, scene.north, scene.res
+  records = []
+
+  def stage(name, function, rows_in, rows_out=len):
+    """Benchmark function, counting the rows of its result with rows_out."""
+    result, seconds, peak_mb = measure(function, repeat)
+    rows_out = rows_out(result) if hasattr(result, '__len__') else None
+    records.append({'stage': name, 'size': size, 'seconds': seconds,
+                    'peak_mb': peak_mb, 'rows_in': rows_in,
+                    'rows_out': rows_out})
+    print('{:>6} {:<26} {:9.3f} s {:9.1f} MB'.format(size, name, seconds,
+                                                     peak_mb))
+    return result
+
+  # Cliff detection, in memory, in tiles, and streamed from a memory map.
+  cliffs, labels = stage('get_cliffs', lambda: get_cliffs(
+    dem, west, north, res, return_labels=True), dem.size,
+    rows_out=lambda result: len(result[0]))
+  stage('get_cliffs_tiled', lambda: get_cliffs_tiled(
+    dem, west, north, res, tile_size=512), dem.size)
+  path = os.path.join(tmp_dir, 'dem_{}.npy'.format(size))
+  np.save(path, dem)
+  raster = Raster.from_npy(path, west, north, res)
+  stage('get_cliffs_streamed', lambda: get_cliffs_tiled(
+    raster, west, north, res, tile_size=512), dem.size)
+
+  # Enrichments, each on a fresh copy of the cliffs: the few detected ones,
+  # which mostly measures the fixed cost of each call, and the random ones,
+  # whose number grows with the scene.
+  roads = RoadIndex(scene.roads)
+  mp = MPIndex(scene.mp_data)
+  for suffix, table, table_labels in [('', cliffs, labels),
+                                      ('_random', scene.cliffs,
+                                       scene.cliff_labels)]:
+    def enrich(name, function):
+      stage(name + suffix, lambda: function(table.copy()), len(table))
+    enrich('set_road_within_distance',
+           lambda df: set_road_within_distance(df, roads))
+    enrich('set_population',
+           lambda df: set_population(df, scene.population, west, north, res))
+    enrich('set_lithology',
+           lambda df: set_lithology(df, scene.lithology, west, north, res))
+    enrich('set_mp_score', lambda df: set_mp_score(df, mp))
+    enrich('set_landsat_data',
+           lambda df: set_landsat_data(df, table_labels, scene.landsat))
+
+  # Contours and fractal stats around the highest point of a window.
+  window = smooth_dem(dem[:CONTOUR_WINDOW, :CONTOUR_WINDOW])
+  row, col = np.unravel_index(np.argmax(window), window.shape)
+  summit = (west + (col + 0.5) * res, north - (row + 0.5) * res)
+  levels = range(int(window.min()) // CONTOUR_INTERVAL * CONTOUR_INTERVAL,
+                 int(window.max()), CONTOUR_INTERVAL)
+  contours = stage('summit_contours', lambda: summit_contours(
+    window, west, north, res, summit, levels), window.size)
+  stage('contour_stats', lambda: contour_stats(contours), len(contours))
+
+  # Terrain layers and gradient descent from random seeds.
+  layers = stage('build_layers', lambda: build_layers(dem, west, north, res),
+                 dem.size)
+  rng = np.random.default_rng(SEED)
+  longitude = west + rng.uniform(0, size, NUM_SEEDS) * res
+  latitude = north - rng.uniform(0, size, NUM_SEEDS) * res
+  stage('grad_descent', lambda: grad_descent(layers, longitude, latitude)[
+    'path'][0], NUM_SEEDS)
+
+  # Scoring candidates with compiled linear and tree models.
+  explored = pd.read_csv(os.path.join(HERE, '..', 'big-wall-prediction',
+                                      'data', 'explored.csv'), nrows=1)
+  features = [c for c in explored.columns
+              if c not in ['latitude', 'longitude', 'mp_score']]
+  num_candidates = size * size // 16
+  candidates = pd.DataFrame(rng.random((num_candidates, len(explored.columns))),
+                            columns=explored.columns)
+  linear_path = os.path.join(tmp_dir, 'linear.npz')
+  save_model(linear_path, 'linear', features,
+             coef=rng.normal(size=len(features)), intercept=np.float64(0))
+  xgb_path = os.path.join(tmp_dir, 'xgb.npz')
+  save_model(xgb_path, 'xgb', features, base_score=np.float64(0.5),
+             **flatten_trees(random_trees(len(features), rng), features))
+  for name, model_path in [('linear', linear_path), ('xgb', xgb_path)]:
+    model = CompiledModel.load(model_path)
+    stage('top_k_' + name, lambda: top_k(model.predict, candidates),
+          num_candidates)
+
+  records.append({'stage': 'planted_walls', 'size': size,
+                  'planted': len(scene.walls),
+                  'found': planted_walls_found(scene.walls, cliffs)})
+  return records
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+  parser.add_argument('--repeat', type=int, default=1)
+  parser.add_argument('--output', default='benchmark_results.json')
+  args = parser.parse_args()
+
+  records = []
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for size in args.sizes:
+      records.extend(run_size(size, args.repeat, tmp_dir))
+
+  results = {
+    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'pandas': pd.__version__,
+    'machine': platform.machine(),
+    'seed': SEED,
+    'repeat': args.repeat,
+    'max_rss_mb': max_rss_mb(),
+    'results': records,
+  }
+  with open(args.output, 'w') as file:
+    json.dump(results, file, indent=2)
+  print('Wrote', args.output)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,152 @@
+"""Deterministic synthetic inputs for the local pipeline stages, so they can be
+benchmarked without earth engine. A scene holds fractal terrain with vertical
+walls of known height planted in it, and everything the enrichments need on
+or around the same grid: roads, population, lithology, a landsat-like image,
+and mountain project areas. Since only a few walls are planted, a scene also
+holds a table of random cliffs, whose number grows with the area of the scene,
+so that the enrichments can be measured on realistic numbers of rows. The same
+seed and size always give the same scene.
+
+Usage:
+  scene = make_scene(1024, seed=0)
+  cliffs = get_cliffs(scene.dem, scene.west, scene.north, scene.res)
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+WEST, NORTH = -111.0, 38.0  # northwest corner of every scene
+RES = 1 / 10800  # 1/3 arc second, about 10 meters, as in USGS/NED
+BASE_ELEVATION = 1500  # in meters
+SPECTRAL_EXPONENT = 3.2  # power spectrum falls off as frequency ** -exponent
+GRADIENT_STD = 0.3  # typical rise over run of the natural terrain
+WALL_HEIGHTS = (100, 400)  # range of heights of the planted walls, in meters
+WALL_SIZES = (10, 40)  # range of sides of the raised blocks, in pixels
+PIXELS_PER_WALL = 2 ** 16
+PIXELS_PER_CLIFF = 2 ** 8  # 1024 random cliffs at 512 x 512, 16384 at 2048
+CLIFF_SIDE = 3  # side of the square patch labeled for each random cliff
+
+Scene = namedtuple('Scene', ['dem', 'west', 'north', 'res', 'walls', 'roads',
+                             'population', 'lithology', 'landsat', 'mp_data',
+                             'cliffs', 'cliff_labels'])
+
+
+def fractal_terrain(size, rng):
+  """Fractal elevation by spectral synthesis: white noise shaped in the
+  frequency domain, then scaled so that slopes are moderate everywhere."""
+  freq = np.fft.fftfreq(size)
+  k = np.hypot(freq[:, np.newaxis], freq[np.newaxis, :])
+  k[0, 0] = np.inf
+  spectrum = np.fft.fft2(rng.standard_normal((size, size)))
+  terrain = np.fft.ifft2(spectrum * k ** (-SPECTRAL_EXPONENT / 2)).real
+
+  # Scaling in meters of rise per meter of run, with 10 meter pixels.
+  gradient = np.hypot(*np.gradient(terrain))
+  terrain *= GRADIENT_STD * 10 / gradient.std()
+  return BASE_ELEVATION + terrain - terrain.min()
+
+
+def plant_walls(dem, rng):
+  """Raise rectangular blocks of terrain by a known height, each ringed by a
+  vertical wall. Blocks are placed in separate cells of a grid so that they
+  never touch. Returns a DataFrame with the center and height of each."""
+  size = dem.shape[0]
+  cells = max(2, int(np.sqrt(size * size / PIXELS_PER_WALL)))
+  cell = size // cells
+  walls = []
+  for i in range(cells):
+    for j in range(cells):
+      rows, cols = rng.integers(*WALL_SIZES, size=2)
+      r0 = i * cell + rng.integers(2, cell - rows - 2)
+      c0 = j * cell + rng.integers(2, cell - cols - 2)
+      height = rng.uniform(*WALL_HEIGHTS)
+      dem[r0:r0 + rows, c0:c0 + cols] += height
+      walls.append({'latitude': NORTH - (r0 + rows / 2) * RES,
+                    'longitude': WEST + (c0 + cols / 2) * RES,
+                    'height': height,
+                    'half_diagonal': np.hypot(rows, cols) / 2 * RES})
+  return pd.DataFrame(walls)
+
+
+def random_roads(size, rng, num_roads):
+  """Roads as random walks, as lists of (longitude, latitude) vertices."""
+  roads = []
+  for _ in range(num_roads):
+    steps = rng.normal(0, 20, size=(size // 10, 2)).cumsum(axis=0)
+    start = rng.uniform(0, size, size=2)
+    pixels = np.clip(start + steps, 0, size)
+    roads.append(np.stack([WEST + pixels[:, 1] * RES,
+                           NORTH - pixels[:, 0] * RES], axis=1))
+  return roads
+
+
+def blocky(size, rng, block):
+  """Random values constant over blocks of block x block pixels."""
+  coarse = rng.random((-(-size // block),) * 2)
+  return np.kron(coarse, np.ones((block, block)))[:size, :size]
+
+
+def mp_areas(walls, size, rng, num_random):
+  """Mountain project areas: one at most walls, where climbers would go, plus
+  some scattered at random."""
+  near = walls[rng.random(len(walls)) < 0.7]
+  latitude = np.concatenate([near.latitude.values,
+                             NORTH - rng.uniform(0, size, num_random) * RES])
+  longitude = np.concatenate([near.longitude.values,
+                              WEST + rng.uniform(0, size, num_random) * RES])
+  n = len(latitude)
+  return pd.DataFrame({
+    'latitude': latitude,
+    'longitude': longitude,
+    'num_boulders': rng.poisson(2, n),
+    'num_rock_routes': rng.poisson(8, n),
+    'num_winter_routes': rng.poisson(1, n),
+    'num_views': rng.poisson(5000, n),
+  })
+
+
+def random_cliffs(size, rng, num_cliffs):
+  """Cliffs at random points, with the columns of local_cliffs.get_cliffs(),
+  and a label raster in which the cliff in row i covers a small square patch
+  labeled i + 1, as returned by get_cliffs(..., return_labels=True). Patches
+  may overlap, in which case later cliffs cover parts of earlier ones."""
+  rows = rng.integers(0, size - CLIFF_SIDE, num_cliffs)
+  cols = rng.integers(0, size - CLIFF_SIDE, num_cliffs)
+  labels = np.zeros((size, size), dtype=np.int64)
+  for dr in range(CLIFF_SIDE):
+    for dc in range(CLIFF_SIDE):
+      labels[rows + dr, cols + dc] = np.arange(1, num_cliffs + 1)
+  cliffs = pd.DataFrame({
+    'height': rng.uniform(*WALL_HEIGHTS, num_cliffs),
+    'pixel_count': np.full(num_cliffs, CLIFF_SIDE ** 2),
+    'latitude': NORTH - (rows + CLIFF_SIDE / 2) * RES,
+    'longitude': WEST + (cols + CLIFF_SIDE / 2) * RES,
+  })
+  return cliffs, labels
+
+
+def make_scene(size, seed=0):
+  """Build a square scene size pixels on a side."""
+  rng = np.random.default_rng([seed, size])
+  dem = fractal_terrain(size, rng)
+  walls = plant_walls(dem, rng)
+
+  # Lithology classes of local_rasters.LITHOLOGY_CLASSES and a few others,
+  # with masked (NaN) patches.
+  classes = np.array([1, 3, 5, 8, 11, 19, 2, 4], dtype=np.float64)
+  lithology = classes[(blocky(size, rng, 64) * len(classes)).astype(int)]
+  lithology[blocky(size, rng, 128) < 0.1] = np.nan
+
+  roads = random_roads(size, rng, max(4, size // 128))
+  population = rng.lognormal(0, 2, (size, size))
+  landsat = rng.random((5, size, size)).astype(np.float32)
+  mp_data = mp_areas(walls, size, rng, size // 4)
+  cliffs, cliff_labels = random_cliffs(size, rng,
+                                       size * size // PIXELS_PER_CLIFF)
+
+  return Scene(
+    dem=dem, west=WEST, north=NORTH, res=RES, walls=walls, roads=roads,
+    population=population, lithology=lithology, landsat=landsat,
+    mp_data=mp_data, cliffs=cliffs, cliff_labels=cliff_labels)
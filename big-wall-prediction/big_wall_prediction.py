@@ -1,17 +1,23 @@
-import pandas as pd
 import numpy as np
 import xgboost as xgb
 from sklearn.linear_model import LinearRegression, LogisticRegression
 from imblearn.over_sampling import SMOTE, SVMSMOTE, ADASYN, RandomOverSampler
 
-# Importing data
-explored = pd.read_csv('data/explored.csv')
-unexplored = pd.read_csv('data/unexplored.csv')
+from columnar import load_dataset
+from compiled_model import export_linear, export_logistic, export_xgb
+from instrumentation import TRACE_DIR, span, traced, tracer
+from scoring import top_k
+
+# Importing data, memory-mapped when prepare_big_wall_data.py has stored it.
+with span('load_datasets') as record:
+  explored = load_dataset('explored')
+  unexplored = load_dataset('unexplored')
+  record['rows_out'] = len(explored) + len(unexplored)
 
 
 def build_x_y(prob=0.9):
   """Create balanced classes by oversampling."""
-  X_pred = unexplored.copy()  # to be used to make predictions
+  X_pred = unexplored  # to be used to make predictions
 
   X = explored.drop(columns=['latitude', 'longitude', 'mp_score'])
   mask = np.random.rand(len(X)) < prob
@@ -30,15 +36,14 @@ def build_x_y(prob=0.9):
   return X_train, y_train, X_test, y_test, X_pred
 
 
+@traced()
 def run_lin_reg():
   """Run a simple linear regression."""
   X_train, y_train, X_test, y_test, X_pred = build_x_y()
   reg = LinearRegression().fit(X_train, y_train)
+  export_linear(reg, X_train.columns, 'data/models/linear_reg.npz')
   print('Linear regression fit score: ' + str(reg.score(X_test, y_test)) + '\n')
-  y_pred = reg.predict(X_pred.drop(columns=['latitude', 'longitude', 'mp_score']))
-  X_pred['predicted_score'] = y_pred
-  X_pred.height *= 1000
-  X_pred = X_pred.sort_values(by='predicted_score', ascending=False)[['latitude', 'longitude', 'height', 'mp_score', 'predicted_score']]
+  X_pred = top_k(reg.predict, X_pred)
   X_pred.to_csv('data/predictions/linear_reg_predictions.csv', header=True, index=False)
 
   print('Top 20 results from linear regression prediction.')
@@ -46,26 +51,24 @@ def run_lin_reg():
   print(X_pred[:20].to_string(index=False))
 
 
+@traced()
 def run_log_reg():
   """Run a simple logistic classification."""
   X_train, y_train, X_test, y_test, X_pred = build_x_y()
   reg = LogisticRegression(max_iter=200).fit(X_train, y_train)
+  export_logistic(reg, X_train.columns, 'data/models/logistic_reg.npz')
   print('Logistic regression fit score: ' + str(reg.score(X_test, y_test)) + '\n')
   
   # Use predict_proba() to get probabilities of hittng a class, not classes themselves.
   # On the otherhand, predict() uses a cutoff at 0.5 to make a choice.
-  y_pred = reg.predict_proba(X_pred.drop(columns=['latitude', 'longitude', 'mp_score']))
-  y_pred = y_pred[:, 1:]
-  
-  X_pred['predicted_score'] = y_pred
-  X_pred.height *= 1000
-  X_pred = X_pred.sort_values(by='predicted_score', ascending=False)[['latitude', 'longitude', 'height', 'mp_score', 'predicted_score']]
+  X_pred = top_k(lambda X: reg.predict_proba(X)[:, 1], X_pred)
   X_pred.to_csv('data/predictions/logistic_reg_predictions.csv', header=True, index=False)
   
   print('Top 20 results from logistic regression prediction.')
   print('A higher score is better!\n')
   print(X_pred[:20].to_string(index=False))
 
+@traced()
 def run_xgb():
   X_train, y_train, X_test, y_test, X_pred = build_x_y()
   # dmatrix = xgb.DMatrix(data=X_train, label=y_train)
@@ -73,11 +76,9 @@ def run_xgb():
   reg = xgb.XGBRegressor(objective ='reg:squarederror', colsample_bytree = 0.3, learning_rate = 0.1,
               max_depth = 5, alpha = 10, n_estimators = 10)
   reg.fit(X_train, y_train)
+  export_xgb(reg, X_train.columns, 'data/models/xgb.npz')
   
-  y_pred = reg.predict(X_pred.drop(columns=['latitude', 'longitude', 'mp_score']))
-  X_pred['predicted_score'] = y_pred
-  X_pred.height *= 1000
-  X_pred = X_pred.sort_values(by='predicted_score', ascending=False)[['latitude', 'longitude', 'height', 'mp_score', 'predicted_score']]
+  X_pred = top_k(reg.predict, X_pred)
   X_pred.to_csv('data/predictions/xgb_predictions.csv', header=True, index=False)
 
   print('Top 20 results from xgb prediction.')
@@ -94,4 +95,5 @@ def run_xgb():
 if __name__ == '__main__':
   run_lin_reg()
   run_log_reg()
-  run_xgb()
\ No newline at end of file
+  run_xgb()
+  tracer.write_chrome_trace(TRACE_DIR + '/big_wall_prediction.json')
\ No newline at end of file
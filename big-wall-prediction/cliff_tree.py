@@ -0,0 +1,134 @@
+"""A threshold-independent index of steep terrain. Every change to
+STEEP_THRESHOLD or HEIGHT_THRESHOLD otherwise means repeating the whole cliff
+search. Instead, pixels are added in order of decreasing slope and each merge
+of connected regions is recorded as a node in a component tree. A node keeps
+the elevation min / max, pixel count, and centroid sums of its region, so the
+cliffs for any pair of thresholds can be read off the tree with a few
+vectorized comparisons.
+
+Usage:
+  tree = CliffTree.build(dem, west, north, res)
+  tree.save('data/cliff_tree.npz')
+  cliffs = tree.cliffs(steep_threshold=75, height_threshold=100)
+"""
+
+import numpy as np
+
+from geodesy import pixel_spacing
+from local_cliffs import (HEIGHT_THRESHOLD, STEEP_THRESHOLD, cliffs_from_stats,
+                          horn_slope)
+
+# Pixels flatter than this are left out of the tree. Queries must use a steep
+# threshold at least this large.
+MIN_SLOPE = 60
+
+# The eight neighbors of a pixel, matching EIGHT_CONNECTED in local_cliffs.py.
+NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1),
+                    (0, 1), (1, -1), (1, 0), (1, 1)]
+
+TREE_FIELDS = ['level', 'parent_level', 'ele_min', 'ele_max', 'count',
+               'row_sum', 'col_sum']
+
+
+class CliffTree:
+  """Component tree over the slope of an elevation array. Node k is created
+  when the k-th steepest pixel is added; it describes the connected region of
+  pixels with slope >= level[k] containing that pixel."""
+
+  def __init__(self, west, north, res, min_slope, **fields):
+    self.west, self.north, self.res = west, north, res
+    self.min_slope = min_slope
+    for name in TREE_FIELDS:
+      setattr(self, name, fields[name])
+
+  @classmethod
+  def build(cls, dem, west, north, res, min_slope=MIN_SLOPE):
+    """Build the tree for an elevation array with its northwest corner at
+    (west, north) and pixels res degrees wide."""
+    dem = np.asarray(dem, dtype=np.float64)
+    dx, dy = pixel_spacing(north, res, dem.shape[0])
+    slope = horn_slope(dem, dx, dy)
+
+    # Sorting the candidate pixels from steepest to flattest.
+    rows, cols = np.nonzero(slope > min_slope)
+    order = np.argsort(-slope[rows, cols], kind='stable')
+    rows, cols = rows[order], cols[order]
+    level = slope[rows, cols]
+    n = len(level)
+
+    # Looking up, for every pixel, the neighbors that were added before it.
+    index = np.full((dem.shape[0] + 2, dem.shape[1] + 2), n)
+    index[rows + 1, cols + 1] = np.arange(n)
+    neighbors = np.stack([index[rows + 1 + dr, cols + 1 + dc]
+                          for dr, dc in NEIGHBOR_OFFSETS], axis=1)
+    earlier = neighbors < np.arange(n)[:, np.newaxis]
+
+    # Node k starts out as pixel k alone. Plain lists are much faster than
+    # numpy arrays for the element-by-element updates below.
+    ele_min = np.trunc(dem[rows, cols]).tolist()
+    ele_max = list(ele_min)
+    count = [1] * n
+    row_sum = rows.tolist()
+    col_sum = cols.tolist()
+    parent = [-1] * n
+
+    # Union-find over nodes. The root of every region is its newest node, so
+    # merging regions at pixel k just hangs each old root under node k.
+    roots = list(range(n))
+
+    def find(x):
+      while roots[x] != x:
+        roots[x] = roots[roots[x]]
+        x = roots[x]
+      return x
+
+    for k in np.flatnonzero(earlier.any(axis=1)).tolist():
+      for child in {find(j) for j in neighbors[k, earlier[k]].tolist()}:
+        roots[child] = k
+        parent[child] = k
+        ele_min[k] = min(ele_min[k], ele_min[child])
+        ele_max[k] = max(ele_max[k], ele_max[child])
+        count[k] += count[child]
+        row_sum[k] += row_sum[child]
+        col_sum[k] += col_sum[child]
+
+    parent = np.array(parent, dtype=np.int64)
+    parent_level = np.where(parent >= 0, level[parent], -np.inf)
+    return cls(west, north, res, min_slope, level=level,
+               parent_level=parent_level,
+               ele_min=np.array(ele_min, dtype=np.float64),
+               ele_max=np.array(ele_max, dtype=np.float64),
+               count=np.array(count, dtype=np.int64),
+               row_sum=np.array(row_sum, dtype=np.float64),
+               col_sum=np.array(col_sum, dtype=np.float64))
+
+  def cliffs(self, steep_threshold=STEEP_THRESHOLD,
+             height_threshold=HEIGHT_THRESHOLD):
+    """Get the cliffs for a pair of thresholds. Returns the same DataFrame as
+    local_cliffs.get_cliffs()."""
+    if steep_threshold < self.min_slope:
+      raise ValueError('steep_threshold {} is below the min_slope {} of this '
+                       'tree'.format(steep_threshold, self.min_slope))
+
+    # The regions of slope > steep_threshold are exactly the nodes above the
+    # threshold whose parent is not.
+    keep = (self.level > steep_threshold) & \
+      (self.parent_level <= steep_threshold)
+    stats = (self.ele_min[keep], self.ele_max[keep], self.count[keep],
+             self.row_sum[keep], self.col_sum[keep])
+    return cliffs_from_stats(stats, self.west, self.north, self.res,
+                             height_threshold)
+
+  def save(self, path):
+    """Save the tree to an npz file."""
+    np.savez(path, west=self.west, north=self.north, res=self.res,
+             min_slope=self.min_slope,
+             **{name: getattr(self, name) for name in TREE_FIELDS})
+
+  @classmethod
+  def load(cls, path):
+    """Load a tree saved with save()."""
+    with np.load(path) as data:
+      fields = {name: data[name] for name in TREE_FIELDS}
+      return cls(float(data['west']), float(data['north']), float(data['res']),
+                 float(data['min_slope']), **fields)
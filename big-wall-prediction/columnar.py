@@ -0,0 +1,97 @@
+"""A typed, columnar store for the tables passed between stages
+(explored, unexplored, mp_data). Each table is a directory holding one .npy
+file per column and a schema.json listing the columns in order with their
+dtypes. Columns are loaded as read-only memory maps, so loading a table costs
+almost nothing no matter how many rows it has, and floats keep every bit
+instead of being printed to 17 digits and parsed back.
+
+CSV files can still be written alongside as an export, and load_dataset()
+falls back to the CSV when a table has not been stored yet.
+
+Usage:
+  save_dataset(explored, 'explored', export_csv=True)
+  explored = load_dataset('explored')
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = 'data'
+COLUMNS_DIR = 'columns'  # under DATA_DIR
+SCHEMA_FILE = 'schema.json'
+
+
+def dataset_dir(name, data_dir=DATA_DIR):
+  """Directory of the columnar store of a table."""
+  return os.path.join(data_dir, COLUMNS_DIR, name)
+
+
+def write_columns(df, directory):
+  """Write each column of df to its own .npy file, then the schema. The
+  schema is written last, so a table without one is incomplete."""
+  os.makedirs(directory, exist_ok=True)
+  schema_path = os.path.join(directory, SCHEMA_FILE)
+  if os.path.exists(schema_path):
+    os.remove(schema_path)
+
+  columns = []
+  for i, name in enumerate(df.columns):
+    values = df[name].to_numpy()
+    if values.dtype == object:
+      # Strings, such as system:index, are stored as fixed-width unicode.
+      values = values.astype(str)
+    # Column names may not be valid file names, so files are numbered.
+    file_name = 'column_{}.npy'.format(i)
+    np.save(os.path.join(directory, file_name), values)
+    columns.append({'name': name, 'dtype': values.dtype.str,
+                    'file': file_name})
+
+  schema = {'num_rows': len(df), 'columns': columns}
+  with open(schema_path + '.tmp', 'w') as file:
+    json.dump(schema, file, indent=2)
+  os.replace(schema_path + '.tmp', schema_path)
+
+
+def read_columns(directory, columns=None, mmap=True):
+  """Load a table written by write_columns(). Only the given columns are
+  loaded if columns is not None. With mmap, the DataFrame is backed by
+  read-only memory maps of the column files."""
+  with open(os.path.join(directory, SCHEMA_FILE)) as file:
+    schema = json.load(file)
+  entries = schema['columns']
+  if columns is not None:
+    by_name = {entry['name']: entry for entry in entries}
+    missing = [name for name in columns if name not in by_name]
+    if missing:
+      raise KeyError('Columns not in {}: {}'.format(directory, missing))
+    entries = [by_name[name] for name in columns]
+
+  mmap_mode = 'r' if mmap else None
+  values = {entry['name']: np.load(os.path.join(directory, entry['file']),
+                                   mmap_mode=mmap_mode)
+            for entry in entries}
+  return pd.DataFrame(values, index=pd.RangeIndex(schema['num_rows']),
+                      copy=False)
+
+
+def save_dataset(df, name, data_dir=DATA_DIR, export_csv=False):
+  """Store a table for later stages, and also write data_dir/<name>.csv if
+  export_csv."""
+  df = df.reset_index(drop=True)
+  write_columns(df, dataset_dir(name, data_dir))
+  if export_csv:
+    df.to_csv(os.path.join(data_dir, name + '.csv'), header=True,
+              index=False)
+
+
+def load_dataset(name, data_dir=DATA_DIR, columns=None, mmap=True):
+  """Load a table stored by save_dataset(), or its CSV if it has not been
+  stored."""
+  directory = dataset_dir(name, data_dir)
+  if os.path.exists(os.path.join(directory, SCHEMA_FILE)):
+    return read_columns(directory, columns=columns, mmap=mmap)
+  df = pd.read_csv(os.path.join(data_dir, name + '.csv'), usecols=columns)
+  return df if columns is None else df[columns]
@@ -0,0 +1,157 @@
+"""Export fitted models to plain numpy arrays, and score cliffs with them using
+nothing but numpy. Training in big_wall_prediction.py needs pandas, sklearn,
+imblearn, and xgboost; a worker that only scores cliffs can load an exported
+model in milliseconds instead.
+
+A model is saved as a .npz file holding its kind, its feature names, and
+  linear, logistic: coef and intercept
+  xgb: the nodes of every tree, flattened into arrays indexed by node:
+    feature (-1 for leaves), threshold, yes, no, missing (the child taken
+    when x < threshold, when not, and when x is NaN), and value (of leaves),
+    plus roots (the first node of each tree), base_score and max_depth.
+Trees are evaluated for all rows and all trees at once, one level per step.
+
+Usage:
+  export_xgb(reg, X_train.columns, 'data/models/xgb.npz')
+  model = CompiledModel.load('data/models/xgb.npz')
+  scores = model.predict(candidates)
+"""
+
+import json
+import os
+
+import numpy as np
+
+KINDS = ['linear', 'logistic', 'xgb']
+
+
+def save_model(path, kind, feature_names, **arrays):
+  """Write a model's arrays to a .npz file."""
+  directory = os.path.dirname(path)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  np.savez(path, kind=np.array(kind),
+           feature_names=np.array(list(feature_names), dtype=str), **arrays)
+
+
+def export_linear(reg, feature_names, path):
+  """Export a fitted sklearn LinearRegression."""
+  save_model(path, 'linear', feature_names,
+             coef=np.asarray(reg.coef_, dtype=np.float64).reshape(-1),
+             intercept=np.float64(reg.intercept_))
+
+
+def export_logistic(reg, feature_names, path):
+  """Export a fitted binary sklearn LogisticRegression. The compiled model
+  predicts the probability of class 1, like predict_proba()[:, 1]."""
+  save_model(path, 'logistic', feature_names,
+             coef=np.asarray(reg.coef_, dtype=np.float64).reshape(-1),
+             intercept=np.float64(np.ravel(reg.intercept_)[0]))
+
+
+def flatten_trees(dumps, feature_names):
+  """Flatten xgboost trees, dumped as JSON, into node arrays. Node ids of
+  each tree are offset so that they index the flattened arrays."""
+  columns = {name: i for i, name in enumerate(feature_names)}
+  columns.update({'f{}'.format(i): i for i in range(len(feature_names))})
+  trees = [json.loads(dump) for dump in dumps]
+
+  # Collecting every node with its depth; node ids within a tree may skip
+  # values after pruning, so each tree gets max id + 1 slots.
+  nodes, sizes, max_depth = [], [], 0
+  for tree in trees:
+    stack, tree_nodes = [(tree, 0)], []
+    while stack:
+      node, depth = stack.pop()
+      tree_nodes.append(node)
+      max_depth = max(max_depth, depth)
+      stack.extend((child, depth + 1) for child in node.get('children', []))
+    nodes.append(tree_nodes)
+    sizes.append(max(node['nodeid'] for node in tree_nodes) + 1)
+
+  roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+  total = int(np.sum(sizes))
+  feature = np.full(total, -1, dtype=np.int64)
+  threshold = np.zeros(total, dtype=np.float32)
+  yes, no, missing = (np.arange(total) for _ in range(3))
+  value = np.zeros(total, dtype=np.float64)
+  for root, tree_nodes in zip(roots, nodes):
+    for node in tree_nodes:
+      i = root + node['nodeid']
+      if 'leaf' in node:
+        value[i] = node['leaf']
+        continue
+      feature[i] = columns[node['split']]
+      threshold[i] = node['split_condition']
+      yes[i], no[i] = root + node['yes'], root + node['no']
+      missing[i] = root + node['missing']
+  return dict(roots=roots, feature=feature, threshold=threshold, yes=yes,
+              no=no, missing=missing, value=value, max_depth=max_depth)
+
+
+def export_xgb(reg, feature_names, path):
+  """Export a fitted xgboost XGBRegressor with a squared error objective."""
+  booster = reg.get_booster()
+  config = json.loads(booster.save_config())
+  # Recent versions of xgboost write base_score as a list, like [5E-1].
+  base_score = config['learner']['learner_model_param']['base_score']
+  base_score = float(str(base_score).strip('[]'))
+  arrays = flatten_trees(booster.get_dump(dump_format='json'), feature_names)
+  save_model(path, 'xgb', feature_names, base_score=np.float64(base_score),
+             **arrays)
+
+
+class CompiledModel:
+  """A model loaded from the arrays written by one of the export functions."""
+
+  def __init__(self, kind, feature_names, arrays):
+    if kind not in KINDS:
+      raise ValueError('Unknown kind of model: {}'.format(kind))
+    self.kind = kind
+    self.feature_names = feature_names
+    self.arrays = arrays
+
+  @classmethod
+  def load(cls, path):
+    """Load a model from a .npz file written by save_model()."""
+    with np.load(path) as data:
+      arrays = {key: data[key] for key in data.files}
+    kind = str(arrays.pop('kind'))
+    feature_names = arrays.pop('feature_names').tolist()
+    return cls(kind, feature_names, arrays)
+
+  def features(self, X):
+    """Get the feature matrix, picking and ordering the model's columns when
+    X is a DataFrame."""
+    if hasattr(X, 'columns'):
+      X = X[self.feature_names].to_numpy()
+    return np.asarray(X, dtype=np.float64)
+
+  def predict(self, X):
+    """Score each row of X."""
+    X = self.features(X)
+    a = self.arrays
+    if self.kind == 'xgb':
+      return a['base_score'] + self.tree_sums(X)
+    margin = X @ a['coef'] + a['intercept']
+    if self.kind == 'logistic':
+      return 1 / (1 + np.exp(-margin))
+    return margin
+
+  def tree_sums(self, X):
+    """Sum the leaves reached by each row over all trees."""
+    a = self.arrays
+    # xgboost compares features as float32.
+    X = X.astype(np.float32)
+    rows = np.arange(len(X))[:, np.newaxis]
+    node = np.broadcast_to(a['roots'], (len(X), len(a['roots']))).copy()
+    for _ in range(int(a['max_depth'])):
+      feature = a['feature'][node]
+      split = feature >= 0
+      if not split.any():
+        break
+      x = X[rows, np.maximum(feature, 0)]
+      child = np.where(x < a['threshold'][node], a['yes'][node], a['no'][node])
+      child = np.where(np.isnan(x), a['missing'][node], child)
+      node = np.where(split, child, node)
+    return a['value'][node].sum(axis=1)
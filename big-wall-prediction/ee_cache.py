@@ -0,0 +1,110 @@
+"""A content-addressed disk cache for earth engine computations. The scripts in
+this repository rebuild the same server-side expressions on every run. Any ee
+object can be serialized into a description of its whole expression graph
+(including the geometry it is reduced over), so the hash of that description
+is used as the cache key and the result of getInfo() is stored locally as JSON.
+
+An entry is reused only when exactly the same expression is fetched again,
+so a script gains from the cache when it fetches the parts it may change
+separately. gather_big_wall_data.gather_rectangle() fetches the cliffs of a
+rectangle and each enrichment with separate calls, so changing one enrichment
+only recomputes that enrichment. The Export tasks in
+gather_big_wall_data.py and mountain_slicer_server_side.py do not go through
+the cache. The least recently used entries are removed once the cache grows
+past max_bytes.
+
+The cache only relies on the serialize() and getInfo() methods of the objects
+passed to it, so it can be exercised with a local stand-in for the ee module.
+
+Usage:
+  cache = EECache('.ee_cache')
+  stats = cache.reduce_region(pop, reducer='sum', geometry=disk)
+  print(cache.stats())
+"""
+
+import hashlib
+import json
+import os
+
+CACHE_DIR = '.ee_cache'
+MAX_BYTES = 2 ** 30
+
+
+class EECache:
+  """Disk cache of getInfo() results keyed on serialized ee expressions."""
+
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Sizes and access times of the entries on disk; the file modification
+    # time is bumped on every hit so that the order survives restarts.
+    self.entries = {}
+    for name in os.listdir(cache_dir):
+      if name.endswith('.json'):
+        stat = os.stat(os.path.join(cache_dir, name))
+        self.entries[name[:-5]] = (stat.st_mtime, stat.st_size)
+
+  def key(self, computed):
+    """Hash the serialized expression graph of an ee object."""
+    return hashlib.sha256(computed.serialize().encode('utf-8')).hexdigest()
+
+  def get_info(self, computed):
+    """Get the value of an ee object, from the cache when possible."""
+    key = self.key(computed)
+    path = os.path.join(self.cache_dir, key + '.json')
+    if key in self.entries:
+      try:
+        with open(path) as file:
+          result = json.load(file)
+      except (OSError, ValueError):
+        # Entry removed or corrupted by another process; recomputing.
+        del self.entries[key]
+      else:
+        self.hits += 1
+        os.utime(path)
+        self.entries[key] = (os.stat(path).st_mtime, self.entries[key][1])
+        return result
+
+    self.misses += 1
+    result = computed.getInfo()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+      json.dump(result, file)
+    os.replace(tmp_path, path)
+    stat = os.stat(path)
+    self.entries[key] = (stat.st_mtime, stat.st_size)
+    self.evict()
+    return result
+
+  def reduce_region(self, image, **kwargs):
+    """Cached version of image.reduceRegion(**kwargs).getInfo()."""
+    return self.get_info(image.reduceRegion(**kwargs))
+
+  def reduce_to_vectors(self, image, **kwargs):
+    """Cached version of image.reduceToVectors(**kwargs).getInfo()."""
+    return self.get_info(image.reduceToVectors(**kwargs))
+
+  def evict(self):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    total = sum(size for _, size in self.entries.values())
+    for key in sorted(self.entries, key=lambda k: self.entries[k][0]):
+      if total <= self.max_bytes:
+        break
+      total -= self.entries.pop(key)[1]
+      try:
+        os.remove(os.path.join(self.cache_dir, key + '.json'))
+      except FileNotFoundError:
+        pass
+
+  def stats(self):
+    """Summarize cache usage."""
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'entries': len(self.entries),
+      'bytes': sum(size for _, size in self.entries.values()),
+    }
@@ -0,0 +1,208 @@
+"""Run a big earth engine export as many smaller export tasks. A single
+Export.table.toDrive() task whose status is printed once cannot retry the part
+of the job that failed. Here a job is split into pieces (for instance, bands
+of latitude), up to max_in_flight tasks run at a time, each task's status is
+polled with exponential backoff, failed tasks are retried, and each finished
+shard is handed to a merge step as soon as it is ready.
+
+Tasks are started and polled through a backend with three coroutines:
+  start(job) -> task
+  status(task) -> state string, as in ee.batch.Task.status()['state']
+  fetch(job) -> DataFrame of the finished shard
+EEBackend uses the ee module; any other object with these methods, such as an
+in-process fake, can stand in for it.
+
+Usage, as in the main block of gather_big_wall_data.py:
+  backend = EEBackend(lambda job: region_results(job.region), drive_dir)
+  merger = CSVMerger('data/big_wall_data.csv')
+  failed = run_exports(backend, latitude_bands(), merger)
+"""
+
+import asyncio
+import glob
+import os
+import re
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+# States reported by ee.batch.Task.status().
+COMPLETED_STATES = {'COMPLETED'}
+FAILED_STATES = {'FAILED', 'CANCELLED', 'CANCEL_REQUESTED'}
+
+# Seconds to wait for a finished export to appear in the synced drive folder.
+FETCH_TIMEOUT = 3600
+
+# What follows the job name in the name of an exported file.
+EXPORTED_NAME = re.compile(r'( \(\d+\))?\.csv')
+
+# A piece of an export. Here region is (west, south, east, north).
+ExportJob = namedtuple('ExportJob', ['name', 'region'])
+
+
+class ExportError(Exception):
+  """Raised when a job fails on every one of its attempts."""
+
+
+def latitude_bands(x0=-125, x1=-102, y0=31, y1=49, dy=1,
+                   prefix='big_wall_data'):
+  """Split the region searched in gather_big_wall_data.py into bands of
+  latitude, one export job per band."""
+  jobs = []
+  y = y0
+  while y < y1:
+    top = min(y + dy, y1)
+    jobs.append(ExportJob('{}_{}_{}'.format(prefix, y, top), (x0, y, x1, top)))
+    y = top
+  return jobs
+
+
+class EEBackend:
+  """Export jobs to google drive with earth engine. The function
+  build_collection takes a job and returns the ee.FeatureCollection to export.
+  Finished shards are read from drive_dir, a local folder synced with the
+  google drive folder."""
+
+  def __init__(self, build_collection, drive_dir, folder='earth-engine',
+               fetch_timeout=FETCH_TIMEOUT):
+    self.build_collection = build_collection
+    self.drive_dir = drive_dir
+    self.folder = folder
+    self.fetch_timeout = fetch_timeout
+    # Time each job was last started, so that files left in drive_dir by an
+    # earlier run or attempt are not taken for its result.
+    self.start_times = {}
+
+  async def start(self, job):
+    import ee
+    task = ee.batch.Export.table.toDrive(
+      collection=self.build_collection(job),
+      description=job.name,
+      fileFormat='CSV',
+      folder=self.folder,
+      fileNamePrefix=job.name,
+    )
+    self.start_times[job.name] = time.time()
+    await asyncio.to_thread(task.start)
+    return task
+
+  async def status(self, task):
+    status = await asyncio.to_thread(task.status)
+    return status['state']
+
+  def exported_file(self, job):
+    """Get the newest file exported for the job since it was last started, or
+    None. Drive saves a file whose name is taken as '<name> (1).csv'."""
+    pattern = os.path.join(glob.escape(self.drive_dir),
+                           glob.escape(job.name) + '*.csv')
+    start_time = self.start_times.get(job.name, 0)
+    paths = [path for path in glob.glob(pattern)
+             if EXPORTED_NAME.fullmatch(os.path.basename(path)[len(job.name):])
+             and os.path.getmtime(path) >= start_time]
+    return max(paths, key=os.path.getmtime, default=None)
+
+  async def fetch(self, job):
+    # Drive can take a little while to sync the exported file.
+    deadline = time.monotonic() + self.fetch_timeout
+    path = self.exported_file(job)
+    while path is None:
+      if time.monotonic() > deadline:
+        raise ExportError('Export {} finished but no new file appeared in {} '
+                          'within {} seconds.'.format(job.name, self.drive_dir,
+                                                      self.fetch_timeout))
+      await asyncio.sleep(10)
+      path = self.exported_file(job)
+    return await asyncio.to_thread(pd.read_csv, path)
+
+
+class CSVMerger:
+  """Append finished shards to one CSV as they arrive. Earth engine leaves out
+  properties that are null for every exported feature and does not fix the
+  order of columns, so each shard is reindexed to the columns of the first."""
+
+  def __init__(self, path):
+    self.path = path
+    self.num_rows = 0
+    self.columns = None
+    if os.path.exists(path):
+      os.remove(path)
+
+  def __call__(self, job, shard):
+    if self.columns is None:
+      self.columns = list(shard.columns)
+    extra = [c for c in shard.columns if c not in self.columns]
+    if extra:
+      print('Dropping columns {} of export {} missing from the first '
+            'shard.'.format(extra, job.name))
+    shard = shard.reindex(columns=self.columns)
+    shard.to_csv(self.path, mode='a', header=not os.path.exists(self.path),
+                 index=False)
+    self.num_rows += len(shard)
+
+
+async def run_attempt(backend, job, max_retries, poll_interval,
+                      max_poll_interval, backoff):
+  """Start a task for the job and poll it until it finishes. Returns the final
+  state. Errors from status(), such as transient HTTP errors, are retried with
+  the same backoff, up to max_retries in a row; the task keeps running in the
+  meantime, so it is not started again."""
+  task = await backend.start(job)
+  delay = poll_interval
+  errors = 0
+  while True:
+    await asyncio.sleep(delay)
+    delay = min(delay * backoff, max_poll_interval)
+    try:
+      state = await backend.status(task)
+    except Exception as error:
+      errors += 1
+      if errors > max_retries:
+        raise
+      print('Polling export {} failed: {!r}'.format(job.name, error))
+      continue
+    errors = 0
+    if state in COMPLETED_STATES or state in FAILED_STATES:
+      return state
+
+
+async def run_job(backend, job, merge, semaphore, max_retries, poll_interval,
+                  max_poll_interval, backoff):
+  """Run one job to completion, retrying failed attempts. An attempt fails
+  when its task ends in a failed state or when starting or polling it raises.
+  The semaphore is only held while a task runs on earth engine, not while
+  waiting to retry or for the shard to reach drive."""
+  for attempt in range(max_retries + 1):
+    async with semaphore:
+      try:
+        state = await run_attempt(backend, job, max_retries, poll_interval,
+                                  max_poll_interval, backoff)
+      except Exception as error:
+        state = repr(error)
+    if state in COMPLETED_STATES:
+      merge(job, await backend.fetch(job))
+      return
+    print('Export {} ended in state {} on attempt {}.'.format(
+      job.name, state, attempt + 1))
+    await asyncio.sleep(poll_interval * backoff ** attempt)
+  raise ExportError('Export {} failed {} times.'.format(
+    job.name, max_retries + 1))
+
+
+async def run_exports_async(backend, jobs, merge, max_in_flight=4,
+                            max_retries=3, poll_interval=10,
+                            max_poll_interval=300, backoff=2):
+  """Run all jobs with at most max_in_flight tasks at a time. Returns a dict
+  mapping each job that failed to its exception."""
+  semaphore = asyncio.Semaphore(max_in_flight)
+  results = await asyncio.gather(
+    *(run_job(backend, job, merge, semaphore, max_retries, poll_interval,
+              max_poll_interval, backoff) for job in jobs),
+    return_exceptions=True)
+  return {job: result for job, result in zip(jobs, results)
+          if isinstance(result, Exception)}
+
+
+def run_exports(backend, jobs, merge, **kwargs):
+  """Blocking version of run_exports_async()."""
+  return asyncio.run(run_exports_async(backend, jobs, merge, **kwargs))
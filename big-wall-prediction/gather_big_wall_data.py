@@ -1,16 +1,41 @@
 """Split up the western US into small rectangles. Each rectangle is searched for
 big walls. For each big wall found, data is collected. Results are exported to
-google drive. Use small rectangle to split bigger region into batches; this
-avoids error (Too many pixels in region) in calling reduceToVector method.
+google drive, one band of latitude per task, through export_orchestrator.py,
+and the finished bands are merged into one CSV. Use small rectangle to split
+bigger region into batches; this avoids error (Too many pixels in region) in
+calling reduceToVector method.
+
+Rectangles can also be gathered one at a time with gather_rectangle(), which
+fetches the cliffs and each enrichment with a separate getInfo() call through
+an EECache. After changing one enrichment, only its calls miss the cache.
+gather_tile() does this for a (west, south, east, north) tuple, so it can be
+used as the work function of tile_scheduler.run_tiles(), over the grid of
+tile_scheduler.rectangle_grid(region_filter=usa_rectangles). Each worker
+process keeps one cache for all of its rectangles and prints its hit and miss
+counts when it exits.
 """
 
+import json
+import multiprocessing.util
+import os
+
 import ee
-import numpy as np
+import pandas as pd
+
+from ee_cache import CACHE_DIR, EECache
+from export_orchestrator import (CSVMerger, EEBackend, latitude_bands,
+                                 run_exports)
+from instrumentation import TRACE_DIR, span, tracer
+from tile_scheduler import DX, DY, X0, X1, Y0, Y1, rectangle_grid
+
 ee.Initialize()
 
 STEEP_THRESHOLD = 70
 HEIGHT_THRESHOLD = 80
 
+# Local folder synced with the google drive folder that exports are saved to.
+DRIVE_DIR = os.path.expanduser('~/Google Drive/earth-engine')
+
 # Importing datasets
 dem = ee.Image('USGS/NED')
 
@@ -48,6 +73,28 @@ cliffs = cliffs.updateMask(cliffs.gt(HEIGHT_THRESHOLD))
 
 def get_cliffs(rectangle):
   """Search within rectangle at high resolution scale to find cliffs."""
+  features = cliff_polygons(rectangle)
+
+  # Getting data for each polygonal cliff geometry.
+  features = features.map(lambda f: set_landsat_data(f))
+
+  # Now reducing cliff polygon to its centroid and getting more data.
+  features = cliff_centroids(features)
+  features = features.map(lambda f: set_lithology(f))
+  features = features.map(lambda f: set_population(f))
+  features = features.map(lambda f: set_road_within_distance(f, 1000))
+  features = features.map(lambda f: set_road_within_distance(f, 2000))
+  features = features.map(lambda f: set_road_within_distance(f, 3000))
+  features = features.map(lambda f: set_road_within_distance(f, 4000))
+  features = features.map(lambda f: set_road_within_distance(f, 5000))
+  features = features.map(lambda f: set_mp_score(f))
+
+  # Here features is a FeatureCollection object. Casting it to a list.
+  return features.toList(1000)  # maximum number of features per rectangle
+
+
+def cliff_polygons(rectangle):
+  """Get the polygon, height and pixel count of each cliff within rectangle."""
   # Getting the geometry and height of all cliffs within the rectangle.
   # Using height as a label for connectedness.
   features = cliffs.reduceToVectors(
@@ -57,12 +104,11 @@ def get_cliffs(rectangle):
     geometryType='polygon'
   )
   # Renaming elevation properties.
-  features = features.select(['label', 'count'], ['height', 'pixel_count'])
+  return features.select(['label', 'count'], ['height', 'pixel_count'])
 
-  # Getting data for each polygonal cliff geometry.
-  features = features.map(lambda f: set_landsat_data(f))
 
-  # Now reducing cliff polygon to its centroid and getting more data.
+def cliff_centroids(features):
+  """Reduce cliff polygons to their centroids, keeping those with lithology."""
   features = features.map(lambda f: f.centroid(10 ** -2))
   features = features.map(lambda f: f.set(
     'latitude', f.geometry().coordinates().get(1),
@@ -70,18 +116,7 @@ def get_cliffs(rectangle):
   # Need lithology to be unmasked to avoid critical errors.
   features = features.map(lambda f: \
     f.set('centroid_lith', lith.reduceRegion('first', f.geometry()).get('b1')))
-  features = features.filter(ee.Filter.notNull(['centroid_lith']))
-  features = features.map(lambda f: set_lithology(f))
-  features = features.map(lambda f: set_population(f))
-  features = features.map(lambda f: set_road_within_distance(f, 1000))
-  features = features.map(lambda f: set_road_within_distance(f, 2000))
-  features = features.map(lambda f: set_road_within_distance(f, 3000))
-  features = features.map(lambda f: set_road_within_distance(f, 4000))
-  features = features.map(lambda f: set_road_within_distance(f, 5000))
-  features = features.map(lambda f: set_mp_score(f))
-
-  # Here features is a FeatureCollection object. Casting it to a list.
-  return features.toList(1000)  # maximum number of features per rectangle
+  return features.filter(ee.Filter.notNull(['centroid_lith']))
 
 
 def set_population(feature):
@@ -147,37 +182,139 @@ def set_landsat_data(feature):
   return feature.set(bands)
 
 
-# Building an ee.List of rectangles objects.
-x0, x1, dx = -125, -102, 0.25
-y0, y1, dy = 31, 49, 0.25
-
-rectangles = [ee.Geometry.Rectangle(x, y, x + dx, y + dy)
-              for x in np.arange(x0, x1, dx) for y in np.arange(y0, y1, dx)]
-
-rectangles = ee.FeatureCollection(rectangles)
-rectangles = rectangles.filterBounds(usa)
-
-# Casting to an ee.List of geometries rather than an ee.FeatureCollection since
-# the get_cliffs() function cannot be mapped over ee.FeatureCollection.
-rectangles = rectangles.toList(200000)
-rectangles = rectangles.map(lambda f: ee.Feature(f).geometry())
-
-# Running the main job.
-results = rectangles.map(get_cliffs, True)  # dropping nulls
-results = results.flatten()
-
-# Exporting results to google drive.
-results = ee.FeatureCollection(results)  #casting from ee.List
-description = 'steepness_{}_height_{}m'.format(STEEP_THRESHOLD, HEIGHT_THRESHOLD)
-task = ee.batch.Export.table.toDrive(
-  collection=results,
-  description='getting big wall data: ' + description,
-  fileFormat='CSV',
-  folder='earth-engine',
-  fileNamePrefix='big_wall_data_' + description,
-)
-
-
-task.start()
-print('Current status:', task.status())
-# Use ee.batch.Task.list() to see current status of exports.
\ No newline at end of file
+ROAD_DISTANCES = [1000, 2000, 3000, 4000, 5000]
+
+
+def set_roads(feature):
+  """Set road_within_Nm for every distance used in get_cliffs()."""
+  for distance in ROAD_DISTANCES:
+    feature = set_road_within_distance(feature, distance)
+  return feature
+
+
+# Each enrichment of the cliff centroids, with the properties it adds.
+ENRICHMENTS = [
+  (set_lithology, ['geology_carbonate', 'geology_non_carbonate',
+                   'geology_silicic_residual', 'geology_colluvial_sediment',
+                   'geology_glacial_till_coarse', 'geology_alluvium']),
+  (set_population, ['population_within_100km', 'population_within_30km']),
+  (set_roads, ['road_within_' + str(d) + 'm' for d in ROAD_DISTANCES]),
+  (set_mp_score, ['mp_score']),
+]
+CENTROID_PROPERTIES = ['height', 'pixel_count', 'latitude', 'longitude',
+                       'centroid_lith']
+LANDSAT_PROPERTIES = ['B7', 'B6', 'B2', 'B4', 'B5', 'B42', 'B65', 'B67']
+
+
+def properties_table(cache, features, properties):
+  """Fetch some properties of a FeatureCollection through the cache, as a
+  DataFrame indexed by feature id."""
+  info = cache.get_info(features.select(properties, retainGeometry=False))
+  return pd.DataFrame([f['properties'] for f in info['features']],
+                      index=[f['id'] for f in info['features']],
+                      columns=properties)
+
+
+def gather_rectangle(rectangle, cache):
+  """Gather the same data as get_cliffs(), as a DataFrame with the columns of
+  the CSV export read by prepare_big_wall_data.py. The cliffs and each
+  enrichment are fetched with their own cached getInfo() call, in a span that
+  records its cache hits and misses, and joined on feature id, which map()
+  preserves."""
+  tracer.watch_cache('ee', cache)
+  polygons = cliff_polygons(rectangle)
+  centroids = cliff_centroids(polygons)
+  with span('get_cliffs') as record:
+    df = properties_table(cache, centroids, CENTROID_PROPERTIES)
+    record['rows_out'] = len(df)
+  with span('set_landsat_data', rows_in=len(df)):
+    tables = [properties_table(cache, polygons.map(set_landsat_data),
+                               LANDSAT_PROPERTIES)]
+  for enrichment, properties in ENRICHMENTS:
+    with span(enrichment.__name__, rows_in=len(df)):
+      tables.append(properties_table(cache, centroids.map(enrichment),
+                                     properties))
+  # Landsat data of cliffs dropped by cliff_centroids() is left out here.
+  df = df.join(tables, how='left')
+  # As in the export, the feature id is kept as system:index and the centroid
+  # as a GeoJSON point in .geo.
+  df['.geo'] = [json.dumps({'type': 'Point', 'coordinates': [x, y]})
+                for x, y in zip(df.longitude, df.latitude)]
+  return df.rename_axis('system:index').reset_index()
+
+
+def usa_rectangles(rectangles):
+  """Keep the rectangles (west, south, east, north) that touch the US, as the
+  main job does, with a single getInfo() call."""
+  features = ee.FeatureCollection([
+    ee.Feature(ee.Geometry.Rectangle(*bounds), {'index': i})
+    for i, bounds in enumerate(rectangles)])
+  keep = features.filterBounds(usa).aggregate_array('index').getInfo()
+  return [rectangles[i] for i in sorted(keep)]
+
+
+# One EECache per process and cache directory, built on first use, so that the
+# cache directory is scanned once per worker rather than once per rectangle.
+tile_caches = {}
+
+
+def print_cache_stats(cache):
+  print('EE cache stats (process {}): {}'.format(os.getpid(), cache.stats()))
+
+
+def tile_cache(cache_dir=CACHE_DIR):
+  """Get the EECache of this process for cache_dir. Its hit and miss counts
+  are printed when the process, such as a tile_scheduler worker, exits."""
+  if cache_dir not in tile_caches:
+    cache = EECache(cache_dir)
+    tile_caches[cache_dir] = cache
+    # Unlike atexit, these finalizers also run when pool workers exit.
+    multiprocessing.util.Finalize(None, print_cache_stats, args=(cache,),
+                                  exitpriority=10)
+  return tile_caches[cache_dir]
+
+
+def gather_tile(bounds, cache_dir=CACHE_DIR):
+  """Gather the rectangle (west, south, east, north) through a disk cache."""
+  return gather_rectangle(ee.Geometry.Rectangle(*bounds), tile_cache(cache_dir))
+
+
+def region_results(region, dx=DX, dy=DY):
+  """Build the FeatureCollection of cliffs, with all of their data, found in
+  the region (west, south, east, north). The region is split into rectangles
+  of size dx by dy, and those touching the US are searched with get_cliffs().
+  Used to build each export job of export_orchestrator.py."""
+  west, south, east, north = region
+  rectangles = rectangle_grid(west, east, dx, south, north, dy)
+  rectangles = ee.FeatureCollection([ee.Geometry.Rectangle(*r)
+                                     for r in rectangles])
+  rectangles = rectangles.filterBounds(usa)
+
+  # Casting to an ee.List of geometries rather than an ee.FeatureCollection
+  # since the get_cliffs() function cannot be mapped over ee.FeatureCollection.
+  rectangles = rectangles.toList(200000)
+  rectangles = rectangles.map(lambda f: ee.Feature(f).geometry())
+
+  results = rectangles.map(get_cliffs, True)  # dropping nulls
+  results = results.flatten()
+  return ee.FeatureCollection(results)  # casting from ee.List
+
+
+if __name__ == '__main__':
+  # Exporting one band of latitude per task, a few tasks at a time. Finished
+  # shards are read from DRIVE_DIR, a local folder synced with the google
+  # drive folder earth-engine, and merged into one CSV.
+  description = 'steepness_{}_height_{}m'.format(STEEP_THRESHOLD,
+                                                 HEIGHT_THRESHOLD)
+  jobs = latitude_bands(X0, X1, Y0, Y1, prefix='big_wall_data_' + description)
+  backend = EEBackend(lambda job: region_results(job.region), DRIVE_DIR)
+  merger = CSVMerger('data/big_wall_data_' + description + '.csv')
+
+  with span('run_exports', rows_in=len(jobs)) as record:
+    failed = run_exports(backend, jobs, merger)
+    record['rows_out'] = merger.num_rows
+  print('Merged {} cliffs from {} of {} exports.'.format(
+    merger.num_rows, len(jobs) - len(failed), len(jobs)))
+  for job, error in failed.items():
+    print('Export {} failed: {!r}'.format(job.name, error))
+  tracer.write_chrome_trace(TRACE_DIR + '/gather_big_wall_data.json')
@@ -0,0 +1,47 @@
+"""Small geodesy helpers shared by the local (numpy) versions of the earth engine
+computations. Rasters are assumed to be in geographic coordinates with square
+pixels measured in degrees. Row 0 of a raster lies along its northern edge and
+column 0 along its western edge, matching how USGS/NED tiles are laid out.
+"""
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean radius, in meters
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+def pixel_spacing(north, res, num_rows):
+  """Get the east-west spacing of each row and the north-south spacing of
+  pixels, both in meters."""
+  lat = north - (np.arange(num_rows) + 0.5) * res
+  dx = res * METERS_PER_DEGREE * np.cos(np.radians(lat))
+  dy = res * METERS_PER_DEGREE
+  return dx, dy
+
+
+def pixel_to_lat_long(rows, cols, west, north, res):
+  """Convert (possibly fractional) pixel indices to coordinates of the pixel
+  centers."""
+  latitude = north - (np.asarray(rows) + 0.5) * res
+  longitude = west + (np.asarray(cols) + 0.5) * res
+  return latitude, longitude
+
+
+def to_xyz(latitude, longitude):
+  """Convert coordinates to points in space, in meters, on a spherical earth.
+  Straight-line distances between these points are chords of the sphere."""
+  lat = np.radians(latitude)
+  lon = np.radians(longitude)
+  return EARTH_RADIUS * np.stack(
+    [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def distance_to_chord(distance):
+  """Convert a distance along the surface of the earth to a chord length."""
+  return 2 * EARTH_RADIUS * np.sin(np.asarray(distance) / (2 * EARTH_RADIUS))
+
+
+def chord_to_distance(chord):
+  """Convert a chord length to a distance along the surface of the earth."""
+  chord = np.minimum(np.asarray(chord) / (2 * EARTH_RADIUS), 1)
+  return 2 * EARTH_RADIUS * np.arcsin(chord)
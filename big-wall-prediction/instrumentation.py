@@ -0,0 +1,151 @@
+"""Lightweight instrumentation for the pipeline stages and enrichments. A span
+records the wall time of a block of code, the rows going in and out, the hits
+and misses of any watched caches (such as an EECache or the raster_io block
+cache) while it ran, and how much it grew the resident memory of the process:
+both the change in current resident memory, and how far the span raised the
+peak resident memory. The latter is 0 for a span that stayed below an earlier
+peak, however much it allocated. Spans can be nested, and are written as a
+Chrome trace, which can be opened in chrome://tracing or
+https://ui.perfetto.dev.
+
+Usage:
+  @traced()
+  def set_population(features, ...): ...
+
+  with span('load', path=path) as record:
+    df = pd.read_csv(path)
+    record['rows_out'] = len(df)
+
+  tracer.write_chrome_trace('data/traces/prepare.json')
+"""
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+TRACE_DIR = 'data/traces'
+
+
+def rss_mb():
+  """Current resident memory of the process in megabytes, or None where
+  /proc is not available."""
+  try:
+    with open('/proc/self/statm') as file:
+      pages = int(file.read().split()[1])
+  except OSError:
+    return None
+  return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def max_rss_mb():
+  """Peak resident memory of the process so far in megabytes."""
+  # On linux, ru_maxrss is in kilobytes.
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+class Tracer:
+  """Collects the records of finished spans."""
+
+  def __init__(self):
+    self.records = []
+    self.caches = {}
+    self.origin = time.perf_counter()
+
+  def watch_cache(self, name, cache):
+    """Count the hits and misses of cache, an object with hits and misses
+    attributes, in every span."""
+    self.caches[name] = cache
+
+  def cache_counts(self):
+    return {name: (cache.hits, cache.misses)
+            for name, cache in self.caches.items()}
+
+  @contextmanager
+  def span(self, name, rows_in=None, **args):
+    """Time the enclosed block. Yields the record of the span, so that the
+    block can fill in rows_out or add other values."""
+    record = {'name': name, 'rows_in': rows_in, 'rows_out': None}
+    record.update(args)
+    counts = self.cache_counts()
+    rss, max_rss = rss_mb(), max_rss_mb()
+    start = time.perf_counter()
+    try:
+      yield record
+    finally:
+      end = time.perf_counter()
+      record['start'] = start - self.origin
+      record['seconds'] = end - start
+      for cache, (hits, misses) in self.cache_counts().items():
+        record[cache + '_hits'] = hits - counts[cache][0]
+        record[cache + '_misses'] = misses - counts[cache][1]
+      end_rss = rss_mb()
+      record['rss_delta_mb'] = None if rss is None else end_rss - rss
+      record['max_rss_growth_mb'] = max_rss_mb() - max_rss
+      record['thread'] = threading.get_ident()
+      self.records.append(record)
+
+  def traced(self, name=None):
+    """Decorate a function to run in a span. Rows in and out are the lengths
+    of the first argument and of the result, when they have one, as for the
+    set_* enrichments, which take and return a features DataFrame."""
+    def decorate(function):
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+        rows_in = len(args[0]) if args and hasattr(args[0], '__len__') \
+          else None
+        with self.span(name or function.__name__, rows_in) as record:
+          result = function(*args, **kwargs)
+          if hasattr(result, '__len__'):
+            record['rows_out'] = len(result)
+          return result
+      return wrapper
+    return decorate
+
+  def summary(self):
+    """Total calls, time, rows, and memory growth of each span name."""
+    if not self.records:
+      return pd.DataFrame()
+    df = pd.DataFrame(self.records)
+    return df.groupby('name', sort=False).agg(
+      calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+      rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'),
+      rss_delta_mb=('rss_delta_mb', 'sum'),
+      max_rss_growth_mb=('max_rss_growth_mb', 'sum'))
+
+  def chrome_trace(self):
+    """The records as Chrome trace events, with times in microseconds."""
+    pid = os.getpid()
+    events = []
+    for record in self.records:
+      args = {key: value for key, value in record.items()
+              if key not in ('name', 'start', 'seconds', 'thread')}
+      events.append({'name': record['name'], 'ph': 'X', 'pid': pid,
+                     'tid': record['thread'], 'ts': record['start'] * 1e6,
+                     'dur': record['seconds'] * 1e6, 'args': args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def write_chrome_trace(self, path):
+    """Write the records as a Chrome trace JSON file."""
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+      json.dump(self.chrome_trace(), file, indent=1, default=to_json)
+
+
+def to_json(value):
+  """Convert numpy scalars, and anything else json cannot write, for
+  json.dump()."""
+  return value.item() if hasattr(value, 'item') else str(value)
+
+
+# The tracer used by the pipeline scripts and the local enrichments.
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
@@ -0,0 +1,236 @@
+"""A local version of the cliff search in gather_big_wall_data.py. Earth engine
+runs slope > STEEP_THRESHOLD, then reduceConnectedComponents, then
+height > HEIGHT_THRESHOLD on its own servers, one small rectangle at a time.
+Here the same steps run with numpy on an elevation array already on disk, so
+large regions can be swept without quotas or round trips.
+
+Unlike reduceConnectedComponents, no maxSize is imposed on components; the
+height of a cliff is always the exact height of its connected region.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from geodesy import pixel_spacing, pixel_to_lat_long
+
+STEEP_THRESHOLD = 70
+HEIGHT_THRESHOLD = 80
+
+# Earth engine treats diagonal pixels as neighbors when finding components.
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+
+# Columns returned by get_cliffs(); these match the properties that
+# reduceToVectors() and the centroid step produce in gather_big_wall_data.py.
+CLIFF_COLUMNS = ['height', 'pixel_count', 'latitude', 'longitude']
+
+
+def horn_slope(dem, dx, dy):
+  """Calculate slope in degrees with Horn's method. Here dx is the east-west
+  pixel spacing (a scalar or one value per row) and dy is the north-south
+  pixel spacing, both in meters. Pixels on the border of dem have no slope."""
+  dem = np.asarray(dem, dtype=np.float64)
+  dx = np.broadcast_to(np.asarray(dx, dtype=np.float64), (dem.shape[0],))
+  slope = np.full(dem.shape, np.nan)
+  if dem.shape[0] < 3 or dem.shape[1] < 3:
+    return slope
+
+  # Naming the 3x3 window around each interior pixel as
+  #   a b c
+  #   d e f
+  #   g h i
+  a, b, c = dem[:-2, :-2], dem[:-2, 1:-1], dem[:-2, 2:]
+  d, f = dem[1:-1, :-2], dem[1:-1, 2:]
+  g, h, i = dem[2:, :-2], dem[2:, 1:-1], dem[2:, 2:]
+  dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * dx[1:-1, np.newaxis])
+  dz_dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * dy)
+  slope[1:-1, 1:-1] = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+  return slope
+
+
+def label_components(mask):
+  """Label the eight-connected components of mask. Background is labeled 0."""
+  return ndimage.label(mask, structure=EIGHT_CONNECTED)
+
+
+def component_stats(labels, num_labels, elevation):
+  """Get the elevation min, max, pixel count, and row / column sums of each
+  labeled component. Entry k of each array describes label k + 1."""
+  rows, cols = np.nonzero(labels)
+  lab = labels[rows, cols]
+  ele = elevation[rows, cols]
+
+  # Grouping pixels by label with a single sort, then reducing each group.
+  order = np.argsort(lab, kind='stable')
+  lab, ele = lab[order], ele[order]
+  ele_min = np.full(num_labels, np.nan)
+  ele_max = np.full(num_labels, np.nan)
+  if len(lab):
+    starts = np.flatnonzero(np.r_[True, lab[1:] != lab[:-1]])
+    ele_min[lab[starts] - 1] = np.minimum.reduceat(ele, starts)
+    ele_max[lab[starts] - 1] = np.maximum.reduceat(ele, starts)
+
+  count = np.bincount(lab, minlength=num_labels + 1)[1:]
+  row_sum = np.bincount(lab, weights=rows[order], minlength=num_labels + 1)[1:]
+  col_sum = np.bincount(lab, weights=cols[order], minlength=num_labels + 1)[1:]
+  return ele_min, ele_max, count, row_sum, col_sum
+
+
+def cliffs_from_stats(stats, west, north, res, height_threshold):
+  """Build the table of cliffs from component statistics."""
+  ele_min, ele_max, count, row_sum, col_sum = stats
+  height = ele_max - ele_min
+  keep = height > height_threshold
+  count = count[keep]
+  latitude, longitude = pixel_to_lat_long(
+    row_sum[keep] / count, col_sum[keep] / count, west, north, res)
+  return pd.DataFrame({
+    'height': height[keep].astype(int),
+    'pixel_count': count,
+    'latitude': latitude,
+    'longitude': longitude,
+  }, columns=CLIFF_COLUMNS)
+
+
+def get_cliffs(dem, west, north, res, steep_threshold=STEEP_THRESHOLD,
+               height_threshold=HEIGHT_THRESHOLD, return_labels=False):
+  """Search an elevation array for cliffs. The array has its northwest corner
+  at (west, north) and pixels res degrees wide. Returns a DataFrame with one
+  row per cliff. With return_labels, also returns a raster in which the cliff
+  in row i of the DataFrame is labeled i + 1 and everything else is 0."""
+  dem = np.asarray(dem, dtype=np.float64)
+  dx, dy = pixel_spacing(north, res, dem.shape[0])
+  steep = horn_slope(dem, dx, dy) > steep_threshold
+
+  # The earth engine version casts elevation to an integer before reducing.
+  labels, num_labels = label_components(steep)
+  stats = component_stats(labels, num_labels, np.trunc(dem))
+  cliffs = cliffs_from_stats(stats, west, north, res, height_threshold)
+  if not return_labels:
+    return cliffs
+
+  # Relabeling so that only cliffs remain, numbered in DataFrame order.
+  keep = stats[1] - stats[0] > height_threshold
+  relabel = np.zeros(num_labels + 1, dtype=np.int64)
+  relabel[1:][keep] = np.arange(1, keep.sum() + 1)
+  return cliffs, relabel[labels]
+
+
+class UnionFind:
+  """Disjoint sets over the integers 0, ..., size - 1, stored in an array."""
+
+  def __init__(self, size):
+    self.parent = np.arange(size)
+
+  def find(self, x):
+    """Find the root of x, halving the path along the way."""
+    parent = self.parent
+    while parent[x] != x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
+
+  def union(self, x, y):
+    """Merge the sets containing x and y."""
+    x, y = self.find(x), self.find(y)
+    if x != y:
+      self.parent[max(x, y)] = min(x, y)
+
+  def roots(self):
+    """Get the root of every element at once by repeated pointer jumping."""
+    parent = self.parent
+    while True:
+      grandparent = parent[parent]
+      if np.array_equal(grandparent, parent):
+        return parent
+      parent = grandparent
+
+
+def boundary_pairs(above, below):
+  """Pair up labels on either side of a tile boundary. Here above and below
+  are adjacent rows (or columns) of global labels, with 0 as background."""
+  pairs = []
+  for shift in (-1, 0, 1):
+    # Diagonal neighbors are connected too; shift one strip against the other.
+    a = above[max(shift, 0):len(above) + min(shift, 0)]
+    b = below[max(-shift, 0):len(below) + min(-shift, 0)]
+    keep = (a > 0) & (b > 0)
+    pairs.append(np.stack([a[keep], b[keep]], axis=1))
+  return np.unique(np.concatenate(pairs), axis=0)
+
+
+def get_cliffs_tiled(dem, west, north, res, tile_size=1024,
+                     steep_threshold=STEEP_THRESHOLD,
+                     height_threshold=HEIGHT_THRESHOLD):
+  """Search an elevation array for cliffs tile by tile. Each tile is labeled
+  on its own, keeping only per-component statistics and the labels along the
+  tile edges. Components touching across a tile edge are merged afterwards, so
+  a wall spanning several tiles is reported once with its full height. The
+  array can be a numpy memmap; only one tile (plus a one pixel halo) is read at
+  a time. Returns the same DataFrame as get_cliffs()."""
+  num_rows, num_cols = dem.shape
+  row_starts = range(0, num_rows, tile_size)
+  col_starts = range(0, num_cols, tile_size)
+
+  # Labels along the first and last row / column of each tile, assembled into
+  # full-length strips at every global tile boundary.
+  first_rows = {r: np.zeros(num_cols, dtype=np.int64) for r in row_starts}
+  last_rows = {r: np.zeros(num_cols, dtype=np.int64) for r in row_starts}
+  first_cols = {c: np.zeros(num_rows, dtype=np.int64) for c in col_starts}
+  last_cols = {c: np.zeros(num_rows, dtype=np.int64) for c in col_starts}
+
+  tile_stats = []
+  num_components = 0
+  for r0 in row_starts:
+    r1 = min(r0 + tile_size, num_rows)
+    for c0 in col_starts:
+      c1 = min(c0 + tile_size, num_cols)
+
+      # Reading the tile with a halo so slope agrees with the untiled search.
+      h0, h1 = max(r0 - 1, 0), min(r1 + 1, num_rows)
+      g0, g1 = max(c0 - 1, 0), min(c1 + 1, num_cols)
+      window = np.asarray(dem[h0:h1, g0:g1], dtype=np.float64)
+      dx, dy = pixel_spacing(north - h0 * res, res, h1 - h0)
+      slope = horn_slope(window, dx, dy)
+      slope = slope[r0 - h0:r1 - h0, c0 - g0:c1 - g0]
+      window = window[r0 - h0:r1 - h0, c0 - g0:c1 - g0]
+
+      labels, num_labels = label_components(slope > steep_threshold)
+      ele_min, ele_max, count, row_sum, col_sum = component_stats(
+        labels, num_labels, np.trunc(window))
+      tile_stats.append((ele_min, ele_max, count,
+                         row_sum + count * r0, col_sum + count * c0))
+
+      # Shifting to global labels, which start at 1.
+      labels = np.where(labels > 0, labels + num_components, 0)
+      num_components += num_labels
+      first_rows[r0][c0:c1] = labels[0]
+      last_rows[r0][c0:c1] = labels[-1]
+      first_cols[c0][r0:r1] = labels[:, 0]
+      last_cols[c0][r0:r1] = labels[:, -1]
+
+  # Merging components that touch across tile boundaries.
+  components = UnionFind(num_components + 1)
+  for r0, r1 in zip(row_starts, row_starts[1:]):
+    for a, b in boundary_pairs(last_rows[r0], first_rows[r1]):
+      components.union(a, b)
+  for c0, c1 in zip(col_starts, col_starts[1:]):
+    for a, b in boundary_pairs(last_cols[c0], first_cols[c1]):
+      components.union(a, b)
+
+  # Reducing the per-tile statistics over each merged component.
+  ele_min, ele_max, count, row_sum, col_sum = (
+    np.concatenate(s) for s in zip(*tile_stats))
+  roots = components.roots()[1:]
+  roots, root_index = np.unique(roots, return_inverse=True)
+  merged_min = np.full(len(roots), np.inf)
+  merged_max = np.full(len(roots), -np.inf)
+  np.minimum.at(merged_min, root_index, ele_min)
+  np.maximum.at(merged_max, root_index, ele_max)
+  stats = (
+    merged_min, merged_max,
+    np.bincount(root_index, weights=count, minlength=len(roots)).astype(int),
+    np.bincount(root_index, weights=row_sum, minlength=len(roots)),
+    np.bincount(root_index, weights=col_sum, minlength=len(roots)),
+  )
+  return cliffs_from_stats(stats, west, north, res, height_threshold)
@@ -0,0 +1,104 @@
+"""A local version of set_landsat_data() from gather_big_wall_data.py. Earth
+engine reduces the landsat composite to its median over each cliff polygon
+with a separate reduceRegion() call. Here all cliffs are handled in one pass
+over a label raster (cliff k labeled k, background 0) and a multi-band image on
+the same grid, using a sort-based grouped median.
+
+The rasters are read a chunk of rows at a time. Pixels of a cliff are held
+only until the last chunk containing that cliff has been read, so memory is
+bounded by the chunk size rather than the number of cliffs.
+"""
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import traced
+
+# Bands selected from the landsat composite in gather_big_wall_data.py.
+LANDSAT_BANDS = ['B7', 'B6', 'B2', 'B4', 'B5']
+
+CHUNK_ROWS = 1024
+
+
+def grouped_percentiles(labels, values, percentiles):
+  """Compute percentiles of values grouped by labels, interpolating linearly
+  like np.percentile(). NaN values are ignored. Returns the labels present and
+  an array of shape (len(percentiles), number of labels present)."""
+  keep = ~np.isnan(values)
+  labels, values = labels[keep], values[keep]
+
+  # Sorting by label, then by value within each label.
+  order = np.lexsort((values, labels))
+  labels, values = labels[order], values[order]
+  present = np.unique(labels)
+  starts = np.searchsorted(labels, present, side='left')
+  counts = np.searchsorted(labels, present, side='right') - starts
+
+  result = np.empty((len(percentiles), len(present)))
+  for i, p in enumerate(percentiles):
+    position = starts + p / 100 * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    fraction = position - lower
+    result[i] = values[lower] + fraction * (values[upper] - values[lower])
+  return present, result
+
+
+def zonal_percentiles(labels, image, percentiles=(50,), chunk_rows=CHUNK_ROWS):
+  """Compute percentiles of each band of image over each labeled zone. Here
+  labels has shape (rows, cols) and image has shape (bands, rows, cols); both
+  can be numpy memmaps. Returns an array of shape
+  (len(percentiles), num_labels + 1, bands), indexed by label."""
+  num_rows = labels.shape[0]
+  chunks = range(0, num_rows, chunk_rows)
+
+  # First pass: the last chunk in which each label appears.
+  num_labels = max((int(labels[r:r + chunk_rows].max()) for r in chunks),
+                   default=0)
+  last_chunk = np.full(num_labels + 1, -1)
+  for k, r in enumerate(chunks):
+    last_chunk[np.unique(labels[r:r + chunk_rows])] = k
+
+  # Second pass: gathering pixels and finishing each label after its last
+  # chunk. Pending pixels belong to labels that continue into later chunks.
+  result = np.full((len(percentiles), num_labels + 1, image.shape[0]), np.nan)
+  pending_labels = np.zeros(0, dtype=np.int64)
+  pending_values = np.zeros((image.shape[0], 0))
+  for k, r in enumerate(chunks):
+    chunk_labels = np.asarray(labels[r:r + chunk_rows])
+    inside = chunk_labels > 0
+    chunk_values = np.asarray(image[:, r:r + chunk_rows], dtype=np.float64)
+    pending_labels = np.concatenate([pending_labels, chunk_labels[inside]])
+    pending_values = np.concatenate(
+      [pending_values, chunk_values[:, inside]], axis=1)
+
+    done = last_chunk[pending_labels] == k
+    for band in range(image.shape[0]):
+      present, band_result = grouped_percentiles(
+        pending_labels[done], pending_values[band, done], percentiles)
+      result[:, present, band] = band_result
+    pending_labels = pending_labels[~done]
+    pending_values = pending_values[:, ~done]
+  return result
+
+
+def add_band_ratios(df):
+  """Add the "band ratios" used as geology features."""
+  df['B42'] = df.B4 / df.B2
+  df['B65'] = df.B6 / df.B5
+  df['B67'] = df.B6 / df.B7
+  return df
+
+
+@traced()
+def set_landsat_data(features, labels, image, bands=LANDSAT_BANDS,
+                     chunk_rows=CHUNK_ROWS):
+  """Add the median of each landsat band over each cliff, plus band ratios, as
+  columns of the features DataFrame. Row i of features is the cliff labeled
+  i + 1, as returned by local_cliffs.get_cliffs(..., return_labels=True)."""
+  medians = zonal_percentiles(labels, image, (50,), chunk_rows)[0]
+  medians = pd.DataFrame(medians[1:len(features) + 1], columns=bands,
+                         index=features.index)
+  for band in bands:
+    features[band] = medians[band]
+  return add_band_ratios(features)
@@ -0,0 +1,74 @@
+"""A local version of set_mp_score() from gather_big_wall_data.py. Rather than
+buffering each cliff and filtering the uploaded mountain project collection
+one feature at a time, the areas in data/mp_data.csv are indexed in a KD-tree
+and joined against all cliffs in one batch. Several radii can be summed at
+once, so other scoring rules can be tried without gathering again.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from columnar import load_dataset
+from geodesy import distance_to_chord, to_xyz
+from instrumentation import traced
+
+# Radius, in meters, used for mp_score in gather_big_wall_data.py.
+MP_RADIUS = 1500
+
+# Columns of mp_data.csv summed around each cliff.
+MP_COLUMNS = ['num_boulders', 'num_rock_routes', 'num_winter_routes',
+              'num_views']
+
+
+class MPIndex:
+  """KD-tree over mountain project areas."""
+
+  def __init__(self, mp_data):
+    self.mp_data = mp_data.reset_index(drop=True)
+    self.tree = cKDTree(to_xyz(self.mp_data.latitude.values,
+                               self.mp_data.longitude.values))
+
+  @classmethod
+  def from_csv(cls, path='data/mp_data.csv'):
+    """Load the areas written by parse_mp_data.py."""
+    return cls(pd.read_csv(path))
+
+  @classmethod
+  def from_dataset(cls, name='mp_data', data_dir='data'):
+    """Load the areas stored by parse_mp_data.py (see columnar.py)."""
+    return cls(load_dataset(name, data_dir=data_dir))
+
+  def sums_within(self, latitude, longitude, radii=(MP_RADIUS,),
+                  columns=MP_COLUMNS):
+    """Sum mountain project columns over the areas within each radius (in
+    meters) of each point. Returns a DataFrame with one row per point and a
+    column named like num_views_within_1500m for each column and radius."""
+    points = to_xyz(np.asarray(latitude, dtype=np.float64),
+                    np.asarray(longitude, dtype=np.float64)).reshape(-1, 3)
+    chords = distance_to_chord(np.asarray(radii, dtype=np.float64))
+
+    # All (point, area) pairs within the largest radius, found in one pass.
+    pairs = cKDTree(points).sparse_distance_matrix(
+      self.tree, chords.max(), output_type='ndarray')
+
+    sums = {}
+    for radius, chord in zip(radii, chords):
+      close = pairs['v'] <= chord
+      point_index, area_index = pairs['i'][close], pairs['j'][close]
+      for column in columns:
+        weights = self.mp_data[column].values[area_index]
+        sums[column + '_within_' + str(radius) + 'm'] = np.bincount(
+          point_index, weights=weights, minlength=len(points))
+    return pd.DataFrame(sums)
+
+
+@traced()
+def set_mp_score(features, mp, radius=MP_RADIUS):
+  """Use mountain project data to give score based on routes and views."""
+  sums = mp.sums_within(features.latitude.values, features.longitude.values,
+                        radii=[radius], columns=['num_rock_routes', 'num_views'])
+  suffix = '_within_' + str(radius) + 'm'
+  features['mp_score'] = (2000 * sums['num_rock_routes' + suffix] +
+                          sums['num_views' + suffix]).values
+  return features
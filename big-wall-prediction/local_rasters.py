@@ -0,0 +1,145 @@
+"""A local version of the population and lithology enrichments in
+gather_big_wall_data.py. Earth engine sums the population raster over two big
+disks around every cliff and builds a lithology histogram over a 1km disk,
+repeating the same work for neighboring cliffs. Here each raster is turned into
+summed-area tables once, after which a box sum costs O(1) per cliff and an
+exact disk sum costs O(radius) per cliff, vectorized over all cliffs.
+
+Rasters are in geographic coordinates as described in geodesy.py. Masked
+pixels should be NaN.
+"""
+
+import numpy as np
+
+from geodesy import METERS_PER_DEGREE
+from instrumentation import traced
+
+# Lithology classes of 'CSP/ERGo/1_0/US/lithology' kept as features.
+LITHOLOGY_CLASSES = {
+  1: 'geology_carbonate',
+  3: 'geology_non_carbonate',
+  5: 'geology_silicic_residual',
+  8: 'geology_colluvial_sediment',
+  11: 'geology_glacial_till_coarse',
+  19: 'geology_alluvium',
+}
+
+POPULATION_RADII = [100000, 30000]  # in meters
+LITHOLOGY_RADIUS = 1000  # in meters
+MAX_SPANS = 2 ** 22  # row spans of exact disk sums computed at once
+
+
+class SummedAreaTable:
+  """Summed-area table of a raster, padded with a row and column of zeros so
+  that table[r, c] is the sum of values[:r, :c]."""
+
+  def __init__(self, values, west, north, res):
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    self.west, self.north, self.res = west, north, res
+    self.shape = values.shape
+    self.table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=self.table[1:, 1:])
+
+  def box_sum(self, row0, row1, col0, col1):
+    """Sum values over the boxes [row0, row1) x [col0, col1). Indices are
+    arrays and are clipped to the raster."""
+    row0, row1 = (np.clip(r, 0, self.shape[0]) for r in (row0, row1))
+    col0, col1 = (np.clip(c, 0, self.shape[1]) for c in (col0, col1))
+    t = self.table
+    return t[row1, col1] - t[row0, col1] - t[row1, col0] + t[row0, col0]
+
+  def disk_sum(self, latitude, longitude, radius, exact=True):
+    """Sum values over the disk of radius meters around each point. Pixels
+    whose centers fall in the disk are counted, as in reduceRegion(). With
+    exact=False, the disk is replaced by the box of the same area; this costs
+    O(1) per point but miscounts pixels near the edge of the disk."""
+    row, col, row_radius, col_radius = self._disk_in_pixels(
+      latitude, longitude, radius)
+    if not exact:
+      # Half-widths of the box with the same area as the ellipse.
+      half_rows = row_radius * np.sqrt(np.pi) / 2
+      half_cols = col_radius * np.sqrt(np.pi) / 2
+      return self.box_sum(np.round(row - half_rows).astype(int),
+                          np.round(row + half_rows).astype(int),
+                          np.round(col - half_cols).astype(int),
+                          np.round(col + half_cols).astype(int))
+
+    # The disk is a stack of row spans; each span is a difference of two
+    # entries of the table in adjacent rows. Rows outside the raster sum to 0,
+    # so offsets that fall outside it for every point are skipped; with large
+    # disks on a small raster, most of them would be.
+    row_floor = np.floor(row).astype(int)
+    reach = int(np.ceil(row_radius))
+    if len(row_floor) == 0:
+      return np.zeros(0)
+    offsets = np.arange(max(-reach, -row_floor.max() - 1),
+                        min(reach, self.shape[0] - row_floor.min()) + 1)
+    if len(offsets) == 0:
+      # Every disk lies entirely above or below the raster.
+      return np.zeros(len(row))
+
+    # Points are handled in chunks, so that the arrays of spans of a chunk
+    # hold about MAX_SPANS entries.
+    chunk = max(1, MAX_SPANS // len(offsets))
+    return np.concatenate([
+      self._disk_spans(row[i:i + chunk], col[i:i + chunk], row_radius,
+                       col_radius[i:i + chunk], offsets)
+      for i in range(0, len(row), chunk)])
+
+  def _disk_spans(self, row, col, row_radius, col_radius, offsets):
+    """Sum the row spans at the given offsets of the disk around each point."""
+    rows = np.floor(row).astype(int)[:, np.newaxis] + offsets
+    dy = (rows + 0.5 - row[:, np.newaxis]) / row_radius
+    half_width = col_radius[:, np.newaxis] * \
+      np.sqrt(np.clip(1 - dy ** 2, 0, None))
+    # Pixels with centers c + 0.5 in [col - half_width, col + half_width].
+    col0 = np.ceil(col[:, np.newaxis] - half_width - 0.5).astype(int)
+    col1 = np.floor(col[:, np.newaxis] + half_width - 0.5).astype(int) + 1
+    inside = (np.abs(dy) <= 1) & (col1 > col0)
+    spans = self.box_sum(rows, rows + 1, col0, col1)
+    return np.where(inside, spans, 0).sum(axis=1)
+
+  def _disk_in_pixels(self, latitude, longitude, radius):
+    """Get the fractional pixel position of each point and the radius of the
+    disk around it in rows and columns."""
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    row = (self.north - latitude) / self.res
+    col = (longitude - self.west) / self.res
+    row_radius = radius / (self.res * METERS_PER_DEGREE)
+    col_radius = row_radius / np.cos(np.radians(latitude))
+    return row, col, row_radius, col_radius
+
+
+@traced()
+def set_population(features, pop, west, north, res, radii=POPULATION_RADII,
+                   exact=True):
+  """Add population_within_Nkm columns to the features DataFrame. Here pop is
+  the population count raster."""
+  table = SummedAreaTable(pop, west, north, res)
+  for radius in radii:
+    count = table.disk_sum(features.latitude.values, features.longitude.values,
+                           radius, exact=exact)
+    features['population_within_' + str(radius // 1000) + 'km'] = \
+      count.astype(int)
+  return features
+
+
+@traced()
+def set_lithology(features, lith, west, north, res, radius=LITHOLOGY_RADIUS):
+  """Add the fraction of each lithology class within radius meters of each
+  feature as columns of the features DataFrame. Here lith is the raster of
+  lithology classes."""
+  lith = np.asarray(lith)
+  latitude, longitude = features.latitude.values, features.longitude.values
+
+  # As with the frequencyHistogram reducer, the fractions are relative to all
+  # unmasked pixels within the disk.
+  valid = SummedAreaTable(~np.isnan(lith.astype(np.float64)), west, north, res)
+  total = valid.disk_sum(latitude, longitude, radius)
+  for lith_class, column in LITHOLOGY_CLASSES.items():
+    table = SummedAreaTable(lith == lith_class, west, north, res)
+    count = table.disk_sum(latitude, longitude, radius)
+    features[column] = np.divide(count, total, out=np.full_like(count, np.nan),
+                                 where=total > 0)
+  return features
@@ -0,0 +1,141 @@
+"""A local version of the road enrichment in gather_big_wall_data.py. There,
+set_road_within_distance() buffers each cliff and filters the whole TIGER roads
+collection once per distance. Here the road segments are indexed once in a
+KD-tree, the distance from every cliff to its nearest road is found in one
+batch, and each road_within_Nm flag is read off that single distance.
+
+Roads can be loaded from a GeoJSON export of 'TIGER/2016/Roads', or built
+from any list of polylines given as arrays of (longitude, latitude) vertices.
+"""
+
+import json
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from geodesy import EARTH_RADIUS, chord_to_distance, distance_to_chord, to_xyz
+from instrumentation import traced
+
+# Distances, in meters, used for the road_within_Nm properties.
+ROAD_DISTANCES = [1000, 2000, 3000, 4000, 5000]
+
+# Road segments are split into pieces no longer than this, in meters. Short
+# pieces keep the candidate search around each cliff tight.
+MAX_PIECE_LENGTH = 250
+
+
+class RoadIndex:
+  """Spatial index over road segments for nearest-road queries."""
+
+  def __init__(self, polylines, max_piece_length=MAX_PIECE_LENGTH):
+    starts, ends = [], []
+    for line in polylines:
+      line = np.asarray(line, dtype=np.float64)
+      if len(line) < 2:
+        continue
+      xyz = to_xyz(line[:, 1], line[:, 0])
+      starts.append(xyz[:-1])
+      ends.append(xyz[1:])
+    starts = np.concatenate(starts) if starts else np.zeros((0, 3))
+    ends = np.concatenate(ends) if ends else np.zeros((0, 3))
+    self.starts, self.ends = split_segments(starts, ends, max_piece_length)
+
+    # Any piece within distance d of a point has its midpoint within
+    # d + max_half_length of that point.
+    lengths = np.linalg.norm(self.ends - self.starts, axis=1)
+    self.max_half_length = lengths.max() / 2 if len(lengths) else 0
+    self.tree = cKDTree((self.starts + self.ends) / 2)
+
+  @classmethod
+  def from_geojson(cls, path, **kwargs):
+    """Load roads from a GeoJSON FeatureCollection of LineString and
+    MultiLineString features."""
+    with open(path) as file:
+      features = json.load(file)['features']
+    polylines = []
+    for feature in features:
+      geometry = feature['geometry']
+      if geometry['type'] == 'LineString':
+        polylines.append(geometry['coordinates'])
+      elif geometry['type'] == 'MultiLineString':
+        polylines.extend(geometry['coordinates'])
+    return cls(polylines, **kwargs)
+
+  def nearest_distance(self, latitude, longitude,
+                       max_distance=max(ROAD_DISTANCES)):
+    """Get the distance in meters from each point to the nearest road. Points
+    with no road within max_distance get a distance of inf."""
+    points = to_xyz(np.asarray(latitude, dtype=np.float64),
+                    np.asarray(longitude, dtype=np.float64)).reshape(-1, 3)
+    distance = np.full(len(points), np.inf)
+    if not len(points) or not len(self.starts):
+      return distance
+
+    # The nearest piece is no farther than the nearest midpoint, d0, and its
+    # own midpoint is then within d0 + max_half_length. Searching only that
+    # far keeps a handful of candidates per point even among dense streets.
+    max_chord = distance_to_chord(max_distance)
+    nearest, _ = self.tree.query(
+      points, k=1, distance_upper_bound=max_chord + self.max_half_length)
+    radius = np.minimum(nearest, max_chord) + self.max_half_length
+
+    # Gathering candidate pieces for all points, flattened into pairs.
+    candidates = self.tree.query_ball_point(points, radius)
+    num_candidates = np.array([len(c) for c in candidates])
+    if not num_candidates.sum():
+      return distance
+    point_index = np.repeat(np.arange(len(points)), num_candidates)
+    piece_index = np.concatenate([c for c in candidates if c]).astype(np.int64)
+
+    # Exact distance from each point to each of its candidate pieces.
+    chords = point_segment_distance(points[point_index],
+                                    self.starts[piece_index],
+                                    self.ends[piece_index])
+
+    # Taking the minimum over the candidates of each point.
+    has_candidates = num_candidates > 0
+    offsets = np.r_[0, np.cumsum(num_candidates[has_candidates])[:-1]]
+    distance[has_candidates] = chord_to_distance(
+      np.minimum.reduceat(chords, offsets))
+    distance[distance > max_distance] = np.inf
+    return distance
+
+
+def split_segments(starts, ends, max_length):
+  """Split segments into equal pieces no longer than max_length. Pieces are
+  pushed back onto the sphere, so long segments follow the great circle."""
+  lengths = np.linalg.norm(ends - starts, axis=1)
+  num_pieces = np.maximum(np.ceil(lengths / max_length), 1).astype(np.int64)
+  segment = np.repeat(np.arange(len(starts)), num_pieces)
+  piece = np.arange(len(segment)) - np.repeat(
+    np.cumsum(num_pieces) - num_pieces, num_pieces)
+
+  def point_at(t):
+    point = starts[segment] + t[:, np.newaxis] * (ends[segment] - starts[segment])
+    return point * (EARTH_RADIUS / np.linalg.norm(point, axis=1, keepdims=True))
+
+  return (point_at(piece / num_pieces[segment]),
+          point_at((piece + 1) / num_pieces[segment]))
+
+
+def point_segment_distance(points, starts, ends):
+  """Get the distance from each point to the segment paired with it."""
+  direction = ends - starts
+  length_squared = np.einsum('ij,ij->i', direction, direction)
+  t = np.einsum('ij,ij->i', points - starts, direction)
+  t = np.clip(np.divide(t, length_squared, out=np.zeros_like(t),
+                        where=length_squared > 0), 0, 1)
+  closest = starts + t[:, np.newaxis] * direction
+  return np.linalg.norm(points - closest, axis=1)
+
+
+@traced()
+def set_road_within_distance(features, roads, distances=ROAD_DISTANCES):
+  """Add a road_within_Nm column to the features DataFrame for each distance.
+  Like the earth engine version, each column holds 1 or 0."""
+  distance = roads.nearest_distance(features.latitude.values,
+                                    features.longitude.values,
+                                    max_distance=max(distances))
+  for d in distances:
+    features['road_within_' + str(d) + 'm'] = (distance <= d).astype(int)
+  return features
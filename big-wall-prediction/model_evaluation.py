@@ -0,0 +1,153 @@
+"""Cross-validate the models of big_wall_prediction.py in parallel. Each
+run_*() there scores a model on a single random 90/10 split. Here the
+explored cliffs are split once into stratified folds, and every model is fit
+on every fold in a process pool. The feature matrix is saved to a temporary
+.npy file that each worker memory-maps read-only, so it is not copied into
+every process. Training rows are oversampled inside each fold by drawing
+extra row indices, as RandomOverSampler would. Rather than building a
+resampled copy of the table, each model is fit on the training rows of the
+fold once, with every row weighted by the number of times it was drawn, which
+gives the same fit for the loss of each of these models.
+
+For each model, the mean and spread of the fold scores are reported along
+with the time spent fitting and scoring and the peak memory allocated by a
+single fold (as traced by tracemalloc, which covers numpy arrays but not
+memory allocated inside xgboost).
+
+Usage:
+  python model_evaluation.py
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.linear_model import LinearRegression, LogisticRegression
+
+from columnar import load_dataset
+from instrumentation import max_rss_mb
+
+NUM_FOLDS = 10  # each fold holds out a tenth, as build_x_y() does
+DROP_COLUMNS = ['latitude', 'longitude', 'mp_score']
+
+
+def make_lin_reg():
+  return LinearRegression()
+
+
+def make_log_reg():
+  return LogisticRegression(max_iter=200)
+
+
+def make_xgb():
+  return xgb.XGBRegressor(objective='reg:squarederror', colsample_bytree=0.3,
+                          learning_rate=0.1, max_depth=5, alpha=10,
+                          n_estimators=10)
+
+
+# The models of big_wall_prediction.py, by name.
+MODELS = {
+  'linear_regression': make_lin_reg,
+  'logistic_regression': make_log_reg,
+  'xgb': make_xgb,
+}
+
+
+def build_x_y(explored):
+  """Get the feature matrix and the classes used in big_wall_prediction.py."""
+  X = explored.drop(columns=DROP_COLUMNS).to_numpy(dtype=np.float64)
+  y = (explored.mp_score.to_numpy() > 0).astype(np.int64)
+  return X, y
+
+
+def stratified_folds(y, num_folds=NUM_FOLDS, seed=0):
+  """Assign each row to a fold, spreading each class evenly over the folds.
+  Returns the fold of each row."""
+  rng = np.random.default_rng(seed)
+  folds = np.empty(len(y), dtype=np.int64)
+  for label in np.unique(y):
+    members = rng.permutation(np.flatnonzero(y == label))
+    # Starting each class at a random fold so that remainders even out.
+    folds[members] = (np.arange(len(members)) + rng.integers(num_folds)) % \
+      num_folds
+  return folds
+
+
+def oversample(y, index, rng):
+  """Oversample the rows in index until every class is as common as the most
+  common one. Returns the indices of the resampled rows."""
+  labels, counts = np.unique(y[index], return_counts=True)
+  extra = [rng.choice(index[y[index] == label], counts.max() - count)
+           for label, count in zip(labels, counts)]
+  return np.concatenate([index] + extra)
+
+
+# Data shared by the tasks run in a worker process, set by init_worker().
+shared = {}
+
+
+def init_worker(x_path, y, folds):
+  """Map the feature matrix and keep the classes and folds for the tasks run
+  in this process."""
+  shared['X'] = np.load(x_path, mmap_mode='r')
+  shared['y'] = y
+  shared['folds'] = folds
+
+
+def fit_fold(name, fold, seed):
+  """Fit a model on all folds but one and score it on the one left out."""
+  X, y, folds = shared['X'], shared['y'], shared['folds']
+  test = np.flatnonzero(folds == fold)
+  train = np.flatnonzero(folds != fold)
+  resampled = oversample(y, train, np.random.default_rng([seed, fold]))
+  weights = np.bincount(resampled, minlength=len(y))[train]
+
+  tracemalloc.start()
+  start = time.perf_counter()
+  model = MODELS[name]().fit(X[train], y[train], sample_weight=weights)
+  score = model.score(X[test], y[test])
+  seconds = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {'model': name, 'fold': fold, 'score': score, 'seconds': seconds,
+          'peak_mb': peak / 2 ** 20,
+          'worker_max_rss_mb': max_rss_mb()}
+
+
+def evaluate_models(explored, models=None, num_folds=NUM_FOLDS, processes=None,
+                    seed=0):
+  """Fit every model on every fold in a process pool. Returns a DataFrame
+  summarizing each model and a DataFrame with one row per model and fold."""
+  models = list(MODELS) if models is None else models
+  X, y = build_x_y(explored)
+  folds = stratified_folds(y, num_folds, seed)
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    x_path = os.path.join(tmp_dir, 'X.npy')
+    np.save(x_path, X)
+    del X
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                             initargs=(x_path, y, folds)) as executor:
+      futures = [executor.submit(fit_fold, name, fold, seed)
+                 for name in models for fold in range(num_folds)]
+      results = pd.DataFrame([future.result() for future in futures])
+
+  summary = results.groupby('model', sort=False).agg(
+    mean_score=('score', 'mean'), std_score=('score', 'std'),
+    seconds=('seconds', 'sum'), peak_mb=('peak_mb', 'max'),
+    worker_max_rss_mb=('worker_max_rss_mb', 'max'))
+  return summary, results
+
+
+if __name__ == '__main__':
+  start = time.perf_counter()
+  summary, _ = evaluate_models(load_dataset('explored'))
+  print('Scores over {} stratified folds:\n'.format(NUM_FOLDS))
+  print(summary.to_string())
+  print('\nTotal wall time: {:.1f} s'.format(time.perf_counter() - start))
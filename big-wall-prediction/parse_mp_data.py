@@ -1,17 +1,47 @@
 """Parse data collected with mountain-project-scraper.
-See https://github.com/alexcrist/mountain-project-scraper."""
+See https://github.com/alexcrist/mountain-project-scraper.
+
+The scrape is a JSON list of top-level areas. By default it is read
+incrementally, through a buffer of about CHUNK_SIZE characters. An area that
+ends within the buffer is decoded whole by the json module. Larger or deeper
+areas are decoded key by key with an explicit stack, and each is counted as
+soon as its object closes, then replaced by a small stand-in. Memory holds
+only the open areas along the current path, the routes of one area, and the
+buffer, and deep area trees do not hit the recursion limit. Loading the whole
+tree at once, with streaming off, has neither property. Counts are accumulated
+in flat arrays, indexed by coordinates.
+
+Usage:
+  python parse_mp_data.py
+"""
 
 import json
-import pandas as pd
 import random
-from collections import defaultdict
+import re
+from array import array
+
+import pandas as pd
+
+from columnar import save_dataset
+
+DATA_PATH = 'mountain-project-scraper/clean-data.json'
+
+# Number of characters read from the scrape at a time.
+CHUNK_SIZE = 2 ** 20
+
+# Columns accumulated for each pair of coordinates.
+COUNT_COLUMNS = ['num_boulders', 'num_rock_routes', 'num_winter_routes',
+                 'num_views']
+
+# Whitespace, commas and colons between JSON values, keys and elements.
+SEPARATORS = re.compile(r'[\s,:]*')
 
-# Loading data scraped.
-with open('mountain-project-scraper/clean-data.json') as file:
-  data = json.load(file)
+# Characters of JSON numbers and of true, false and null.
+SCALAR = re.compile(r'[-+.\w]*')
 
-# data is a list; converting it to a dict to match format of children
-root = {'name': 'All Climbing', 'children': data}
+# Stands in for an area that has already been counted, so that its parent can
+# still tell that its children are areas rather than routes.
+COUNTED_AREA = {'children': []}
 
 # Notes on the data tree:
 #   - Each node in the data tree is either an area or a route.
@@ -22,7 +52,15 @@ root = {'name': 'All Climbing', 'children': data}
 #   - Routes do not have lat / long.
 
 
-def print_random_branch():
+def load_root(path=DATA_PATH):
+  """Load the whole data tree."""
+  with open(path) as file:
+    data = json.load(file)
+  # data is a list; converting it to a dict to match format of children
+  return {'name': 'All Climbing', 'children': data}
+
+
+def print_random_branch(root):
   """Print a random branch from the data tree."""
   node = root
   depth = 0
@@ -36,66 +74,245 @@ def print_random_branch():
       print(' ' * depth, key, node[key])
 
 
-# Counting number of routes according to their types. Types of routes include:
-# 'tr', 'trad', 'sport', 'boulder', 'aid', 'mixed', 'ice', 'alpine', and 'snow'.
-# We store data in defaultdicts using the coordinates as keys. We aggregate MP
-# route types into the three distinct types below.
-boulder_dict = defaultdict(int)
-winter_dict = defaultdict(int)
-rock_dict = defaultdict(int)
-# Used to count total number of page views.
-views_dict = defaultdict(int)
+class JSONReader:
+  """Reads JSON values from a file through a buffer that is refilled as
+  needed."""
+
+  def __init__(self, file, chunk_size=CHUNK_SIZE):
+    self.file = file
+    self.chunk_size = chunk_size
+    self.read_size = chunk_size
+    self.decoder = json.JSONDecoder()
+    self.buffer = ''
+    self.pos = 0
+
+  def fill(self):
+    """Read more of the file, dropping what has been consumed. Returns False
+    at the end of the file."""
+    more = self.file.read(self.read_size)
+    self.buffer = self.buffer[self.pos:] + more
+    self.pos = 0
+    # Reading twice as much each time, so that a large value spanning many
+    # chunks is decoded only a few times.
+    self.read_size *= 2
+    return bool(more)
+
+  def fill_scalar(self):
+    """Read more of the file if the number or literal at the next character
+    may continue past the buffer. Returns whether more was read."""
+    end = SCALAR.match(self.buffer, self.pos).end()
+    return end == len(self.buffer) and self.fill()
+
+  def peek(self):
+    """Skip separators and get the next character, or '' at the end of the
+    file."""
+    while True:
+      self.pos = SEPARATORS.match(self.buffer, self.pos).end()
+      if self.pos < len(self.buffer) or not self.fill():
+        return self.buffer[self.pos:self.pos + 1]
+
+  def decode_buffered(self):
+    """Decode the value starting at the next character if it ends within the
+    buffer and is not nested too deeply for the json module. Returns None
+    otherwise, without consuming anything."""
+    try:
+      value, end = self.decoder.raw_decode(self.buffer, self.pos)
+    except (json.JSONDecodeError, RecursionError):
+      return None
+    self.pos = end
+    return value
+
+  def advance(self):
+    """Consume the character returned by peek()."""
+    self.pos += 1
+
+  def decode(self):
+    """Decode the value starting at the next character."""
+    while True:
+      # A number or literal running to the end of the buffer may continue in
+      # the file, and would otherwise be decoded in part.
+      if self.buffer[self.pos] not in '"[{' and self.fill_scalar():
+        continue
+      try:
+        value, end = self.decoder.raw_decode(self.buffer, self.pos)
+      except json.JSONDecodeError:
+        if not self.fill():
+          raise
+        continue
+      self.pos = end
+      self.read_size = self.chunk_size
+      return value
+
 
+def walk_areas(node):
+  """Get the areas below node, and node itself, walking the tree with a
+  stack."""
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    yield node
+    if node['children'] and 'children' in node['children'][0]:
+      stack.extend(node['children'])
 
-def dfs(node):
-  """Populate route_types_dict with DFS."""
 
-  # Sometimes node has 'children' property, but it is an empty list. This
-  # if-statement avoids this situation.
-  if node['children']:
-    # If one child is not a leaf, then no child is a leaf.
-    if 'children' in node['children'][0]:
-      for child in node['children']:
-        dfs(child)
+def iter_areas(file, chunk_size=CHUNK_SIZE):
+  """Decode the areas of the scrape in file one at a time. An area is
+  yielded when its object closes, with subareas that have been yielded
+  already replaced by COUNTED_AREA, or along with its subareas when it is
+  small enough to be decoded whole."""
+  reader = JSONReader(file, chunk_size)
+  if reader.peek() != '[':
+    raise ValueError('Expected a JSON array')
+  reader.advance()
 
-    # All children are leaf nodes, ie, routes!
+  # Objects being read, innermost last. When in_object is False, the elements
+  # of the children of the innermost object (or of the top-level array, when
+  # there is none) are being read.
+  stack = []
+  in_object = False
+  while True:
+    char = reader.peek()
+    if not char:
+      raise ValueError('Unexpected end of JSON')
+
+    if in_object:
+      node = stack[-1]
+      if char == '}':
+        reader.advance()
+        stack.pop()
+        if 'children' in node:
+          yield node
+          node = COUNTED_AREA
+        if stack:
+          stack[-1]['children'].append(node)
+        in_object = False
+        continue
+      key = reader.decode()
+      if reader.peek() == '[' and key == 'children':
+        reader.advance()
+        node['children'] = []
+        in_object = False
+      else:
+        node[key] = reader.decode()
+      continue
+
+    if char == ']':
+      reader.advance()
+      if not stack:
+        return
+      in_object = True
+    elif char == '{':
+      # Elements that end within the buffer are decoded whole by the json
+      # module, which is much faster; only the others are read key by key.
+      node = reader.decode_buffered()
+      if node is None:
+        reader.advance()
+        stack.append({})
+        in_object = True
+        continue
+      if 'children' in node:
+        yield from walk_areas(node)
+        node = COUNTED_AREA
+      if stack:
+        stack[-1]['children'].append(node)
+    elif stack:
+      stack[-1]['children'].append(reader.decode())
     else:
-      # Using parent coordinates as dictionary key
-      key = (node['lat'], node['long'])
-      for child in node['children']:
-        if 'types' in child:
-          types = child['types']
-          if 'boulder' in types:
-            boulder_dict[key] += 1
-          elif 'mixed' in types or 'ice' in types or 'snow' in types:
-            winter_dict[key] += 1
-          else:
-            rock_dict[key] += 1
-        if 'totalViews' in child:
-          views_dict[key] += child['totalViews']
-
-
-dfs(root)
-
-
-# Rarely is a key shared by all three dictionaries; taking the union here so we
-# can iterate over it to build pandas DataFrame.
-keys = set(boulder_dict.keys()).union(
-  set(winter_dict.keys())).union(set(rock_dict.keys()))
-
-# A list of dictionaries to be passed to a pandas DataFrame.
-pre_df = []
-for key in keys:
-  d = {
-    'latitude': key[0],
-    'longitude': key[1],
-    'num_boulders': boulder_dict[key],
-    'num_rock_routes': rock_dict[key],
-    'num_winter_routes': winter_dict[key],
-    'num_views': views_dict[key],
-    }
-  pre_df.append(d)
-
-# Exporting data.
-df = pd.DataFrame(pre_df)
-df.to_csv('data/mp_data.csv', header=True, index=False)
+      reader.decode()
+
+
+class RouteCounts:
+  """Route counts and view totals, one row per (lat, long) key, stored in
+  flat arrays. Views are summed as floats, since the scrape does not promise
+  integer view counts."""
+
+  def __init__(self):
+    self.rows = {}
+    self.columns = {name: array('q') for name in COUNT_COLUMNS}
+    self.columns['num_views'] = array('d')
+
+  def row(self, key):
+    """Get the row of key, adding an empty row if needed."""
+    row = self.rows.get(key)
+    if row is None:
+      row = self.rows[key] = len(self.rows)
+      for column in self.columns.values():
+        column.append(0)
+    return row
+
+  def to_frame(self):
+    """Build a DataFrame of the keys with at least one route with a type."""
+    df = pd.DataFrame({name: column for name, column in self.columns.items()})
+    if (df.num_views % 1 == 0).all():
+      df.num_views = df.num_views.astype('int64')
+    df.insert(0, 'latitude', [key[0] for key in self.rows])
+    df.insert(1, 'longitude', [key[1] for key in self.rows])
+    typed = df[COUNT_COLUMNS[:3]].sum(axis=1) > 0
+    return df[typed].reset_index(drop=True)
+
+
+def view_count(value):
+  """Read a page view count, given as a number or a numeric string. Anything
+  else, such as null, counts as no views."""
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return 0
+
+
+def count_area(node, counts):
+  """Add the routes that are children of node to counts."""
+  # Sometimes node has 'children' property, but it is an empty list.
+  children = node['children']
+  if not children:
+    return
+  # If one child is not a leaf, then no child is a leaf.
+  if 'children' in children[0]:
+    return
+
+  # All children are leaf nodes, ie, routes! Counting number of routes
+  # according to their types. Types of routes include: 'tr', 'trad',
+  # 'sport', 'boulder', 'aid', 'mixed', 'ice', 'alpine', and 'snow'. We
+  # aggregate them into three distinct types, using parent coordinates as
+  # the key.
+  boulders = counts.columns['num_boulders']
+  rock = counts.columns['num_rock_routes']
+  winter = counts.columns['num_winter_routes']
+  views = counts.columns['num_views']
+  row = counts.row((node['lat'], node['long']))
+  for child in children:
+    if 'types' in child:
+      types = child['types']
+      if 'boulder' in types:
+        boulders[row] += 1
+      elif 'mixed' in types or 'ice' in types or 'snow' in types:
+        winter[row] += 1
+      else:
+        rock[row] += 1
+    if 'totalViews' in child:
+      views[row] += view_count(child['totalViews'])
+
+
+def count_routes(node, counts):
+  """Add the routes below node to counts."""
+  for area in walk_areas(node):
+    count_area(area, counts)
+
+
+def parse_mp_data(path=DATA_PATH, streaming=True):
+  """Count routes by type and total page views for each area with routes.
+  With streaming off, the whole tree is loaded at once."""
+  counts = RouteCounts()
+  if streaming:
+    with open(path) as file:
+      for area in iter_areas(file):
+        count_area(area, counts)
+  else:
+    count_routes(load_root(path), counts)
+  return counts.to_frame()
+
+
+if __name__ == '__main__':
+  # Exporting data, as a stored table and as data/mp_data.csv.
+  df = parse_mp_data()
+  save_dataset(df, 'mp_data', export_csv=True)
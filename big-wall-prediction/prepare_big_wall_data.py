@@ -7,7 +7,12 @@ mountain project dataset.
 import pandas as pd
 import numpy as np
 
-df = pd.read_csv('data/big_wall_data_steepness_70_height_80m.csv')
+from columnar import save_dataset
+from instrumentation import TRACE_DIR, span, tracer
+
+with span('load_gathered_data') as record:
+  df = pd.read_csv('data/big_wall_data_steepness_70_height_80m.csv')
+  record['rows_out'] = len(df)
 
 # Dropping columns we don't care about.
 df = df.drop(columns=['system:index', 'centroid_lith', '.geo'])
@@ -18,12 +23,16 @@ df = df.drop(columns=['system:index', 'centroid_lith', '.geo'])
 # surrounding elevation, and hence give "false positives". Manually removing
 # these holds after studying the plot of height vs pixel_count. This removes
 # roughly 100 data points.
-df = df[(df.height < 2.5 * df.pixel_count + 100) & (df.pixel_count > 7)]
+with span('filter_holes', rows_in=len(df)) as record:
+  df = df[(df.height < 2.5 * df.pixel_count + 100) & (df.pixel_count > 7)]
+  record['rows_out'] = len(df)
 
 # Values in landsat and geology columns do not need scaling. They are already
 # distributed somewhat normally around 0 with standard deviation close to 1. We
 # do remove landsat bands with negative values -- around 11 of these.
-df = df[(df.B2 > 0) & (df.B4 > 0) & (df.B5 > 0) & (df.B6 > 0) & (df.B7 > 0)]
+with span('filter_landsat', rows_in=len(df)) as record:
+  df = df[(df.B2 > 0) & (df.B4 > 0) & (df.B5 > 0) & (df.B6 > 0) & (df.B7 > 0)]
+  record['rows_out'] = len(df)
 
 # Reassigning pixel_count to a ratio.
 df.pixel_count /= df.height
@@ -44,8 +53,14 @@ df = df.drop(columns=['road_within_1000m', 'road_within_2000m',
 'road_within_3000m', 'road_within_4000m', 'road_within_5000m',
 'population_within_30km', 'population_within_100km'])
 
-explored = df[accessible]
-unexplored = df[inaccessible]
+with span('split_accessible', rows_in=len(df)) as record:
+  explored = df[accessible]
+  unexplored = df[inaccessible]
+  record['rows_out'] = len(explored) + len(unexplored)
+
+# Storing both tables for big_wall_prediction.py, with CSV exports.
+with span('save_datasets', rows_in=len(explored) + len(unexplored)):
+  save_dataset(explored, 'explored', export_csv=True)
+  save_dataset(unexplored, 'unexplored', export_csv=True)
 
-explored.to_csv('data/explored.csv', header=True, index=False)
-unexplored.to_csv('data/unexplored.csv', header=True, index=False)
\ No newline at end of file
+tracer.write_chrome_trace(TRACE_DIR + '/prepare_big_wall_data.json')
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""Out-of-core access to elevation rasters. A state-sized USGS/NED mosaic at 10m
+does not fit comfortably in memory, so rasters are memory-mapped from disk and
+read one window at a time. Three layouts are supported: raw binary, .npy, and
+uncompressed GeoTIFF (striped or tiled). Classic TIFF files are limited to
+4 GB, so state-sized mosaics are usually written as BigTIFF, which is read as
+well.
+
+When a window falls inside one contiguous block of the file, reading it
+returns a view of the memory map without copying. Windows spanning several
+TIFF tiles or strips are assembled from blocks held in an LRU block cache,
+which is shared by all rasters, so the overlapping halos read by tiled
+algorithms are loaded from disk only once.
+
+A Raster can be sliced like a 2D array, so it can be passed straight to
+local_cliffs.get_cliffs_tiled() to stream through a whole mosaic:
+  dem = Raster.from_geotiff('ned_utah.tif')
+  cliffs = get_cliffs_tiled(dem, dem.west, dem.north, dem.res)
+Smaller regions, such as the area around a summit for local_contours.py, can
+be read by their bounds:
+  window, west, north = dem.read_bounds(-110.93, 36.98, -110.81, 37.08)
+"""
+
+import itertools
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+from instrumentation import tracer
+
+BLOCK_CACHE_BYTES = 2 ** 28
+
+# TIFF tags used here.
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+
+# Struct formats and sizes of TIFF field types.
+TIFF_TYPES = {1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4),
+              6: ('b', 1), 8: ('h', 2), 9: ('i', 4), 11: ('f', 4),
+              12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+
+# Numpy kinds for the SampleFormat tag.
+SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+class BlockCache:
+  """LRU cache of raster blocks, bounded by the total bytes held."""
+
+  def __init__(self, max_bytes=BLOCK_CACHE_BYTES):
+    self.max_bytes = max_bytes
+    self.blocks = OrderedDict()
+    self.num_bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, load):
+    """Get the block stored under key, calling load() to read it on a miss."""
+    if key in self.blocks:
+      self.hits += 1
+      self.blocks.move_to_end(key)
+      return self.blocks[key]
+    self.misses += 1
+    block = load()
+    self.blocks[key] = block
+    self.num_bytes += block.nbytes
+    while self.num_bytes > self.max_bytes and len(self.blocks) > 1:
+      _, old = self.blocks.popitem(last=False)
+      self.num_bytes -= old.nbytes
+    return block
+
+
+# Shared by every raster unless one is given its own. Its hits and misses
+# are recorded in every span.
+block_cache = BlockCache()
+tracer.watch_cache('blocks', block_cache)
+
+# Tokens identifying each raster in block cache keys. Unlike id(), a token is
+# never reused, so a new raster can never be served the blocks of one that has
+# been freed.
+raster_tokens = itertools.count()
+
+
+def read_tiff_tags(path):
+  """Read the tags of the first image in a classic TIFF or BigTIFF file.
+  Returns the byte order and a dict mapping each tag to a tuple of values."""
+  with open(path, 'rb') as file:
+    header = file.read(16)
+    byte_order = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if byte_order is None:
+      raise ValueError('{} is not a TIFF file'.format(path))
+    (magic,) = struct.unpack(byte_order + 'H', header[2:4])
+    if magic == 42:
+      # Classic TIFF: 4 byte offsets, 2 byte entry counts, 12 byte entries.
+      offset_code, count_code, entry_code = 'I', 'H', 'HHI4s'
+      (ifd_offset,) = struct.unpack(byte_order + 'I', header[4:8])
+    elif magic == 43:
+      # BigTIFF: 8 byte offsets, 8 byte entry counts, 20 byte entries.
+      offset_code, count_code, entry_code = 'Q', 'Q', 'HHQ8s'
+      (ifd_offset,) = struct.unpack(byte_order + 'Q', header[8:16])
+    else:
+      raise ValueError('{} is not a TIFF file'.format(path))
+    offset_size = struct.calcsize(offset_code)
+
+    file.seek(ifd_offset)
+    (num_entries,) = struct.unpack(
+      byte_order + count_code, file.read(struct.calcsize(count_code)))
+    entry_size = struct.calcsize(byte_order + entry_code)
+    entries = [struct.unpack(byte_order + entry_code, file.read(entry_size))
+               for _ in range(num_entries)]
+
+    tags = {}
+    for tag, field_type, count, value in entries:
+      if field_type not in TIFF_TYPES:
+        continue
+      code, size = TIFF_TYPES[field_type]
+      if count * size > offset_size:
+        # Values too big for the entry are stored elsewhere in the file.
+        (offset,) = struct.unpack(byte_order + offset_code, value)
+        file.seek(offset)
+        value = file.read(count * size)
+      tags[tag] = struct.unpack(byte_order + code * count,
+                                value[:count * size])
+  return byte_order, tags
+
+
+class Raster:
+  """A single-band raster on disk, in geographic coordinates as described in
+  geodesy.py. The file is split into blocks, each a view of a memory map; block
+  (i, j) covers rows i * block_shape[0] onward and columns j * block_shape[1]
+  onward."""
+
+  def __init__(self, blocks, block_shape, shape, west, north, res,
+               cache=None):
+    self.blocks = blocks
+    self.block_shape = block_shape
+    self.shape = shape
+    self.dtype = next(iter(blocks.values())).dtype
+    self.west, self.north, self.res = west, north, res
+    self.cache = block_cache if cache is None else cache
+    self.token = next(raster_tokens)
+
+  @classmethod
+  def from_npy(cls, path, west, north, res, **kwargs):
+    """Map a 2D .npy file."""
+    array = np.load(path, mmap_mode='r')
+    return cls({(0, 0): array}, array.shape, array.shape, west, north, res,
+               **kwargs)
+
+  @classmethod
+  def from_raw(cls, path, dtype, shape, west, north, res, offset=0, **kwargs):
+    """Map a raw binary file holding a 2D array in row-major order."""
+    array = np.memmap(path, dtype=dtype, mode='r', shape=shape, offset=offset)
+    return cls({(0, 0): array}, shape, shape, west, north, res, **kwargs)
+
+  @classmethod
+  def from_geotiff(cls, path, **kwargs):
+    """Map an uncompressed, single-band GeoTIFF in geographic coordinates."""
+    byte_order, tags = read_tiff_tags(path)
+    if tags.get(COMPRESSION, (1,))[0] != 1:
+      raise ValueError('{} is compressed; only uncompressed TIFF files can be '
+                       'memory-mapped'.format(path))
+    if tags.get(SAMPLES_PER_PIXEL, (1,))[0] != 1:
+      raise ValueError('{} has more than one band'.format(path))
+
+    width, length = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+    kind = SAMPLE_KINDS[tags.get(SAMPLE_FORMAT, (1,))[0]]
+    dtype = np.dtype('{}{}{}'.format(byte_order, kind,
+                                     tags[BITS_PER_SAMPLE][0] // 8))
+
+    if TILE_OFFSETS in tags:
+      block_shape = (tags[TILE_LENGTH][0], tags[TILE_WIDTH][0])
+      offsets = tags[TILE_OFFSETS]
+    else:
+      block_shape = (min(tags.get(ROWS_PER_STRIP, (length,))[0], length),
+                     width)
+      offsets = tags[STRIP_OFFSETS]
+      strip_bytes = block_shape[0] * width * dtype.itemsize
+      if all(b - a == strip_bytes for a, b in zip(offsets, offsets[1:])):
+        # Strips laid out back to back form one contiguous block.
+        block_shape = (length, width)
+        offsets = offsets[:1]
+
+    # Tiles along the right and bottom edges are padded to full size, while
+    # the last strip only holds the remaining rows.
+    # The file is mapped once and every block is a view into that one map, so
+    # a mosaic of many thousands of tiles holds a single file descriptor.
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    blocks_across = -(-width // block_shape[1])
+    blocks = {}
+    for k, offset in enumerate(offsets):
+      i, j = divmod(k, blocks_across)
+      rows = block_shape[0]
+      if TILE_OFFSETS not in tags:
+        rows = min(rows, length - i * block_shape[0])
+      blocks[i, j] = np.ndarray((rows, block_shape[1]), dtype=dtype,
+                                buffer=mm, offset=offset)
+
+    scale = tags[MODEL_PIXEL_SCALE]
+    tiepoint = tags[MODEL_TIEPOINT]
+    res = scale[0]
+    west = tiepoint[3] - tiepoint[0] * res
+    north = tiepoint[4] + tiepoint[1] * scale[1]
+    return cls(blocks, block_shape, (length, width), west, north, res,
+               **kwargs)
+
+  def read(self, row0, row1, col0, col1):
+    """Read the window of rows [row0, row1) and columns [col0, col1). The
+    result is a read-only view when the window lies within one block."""
+    row0, row1 = max(row0, 0), min(row1, self.shape[0])
+    col0, col1 = max(col0, 0), min(col1, self.shape[1])
+    if row1 <= row0 or col1 <= col0:
+      # The window lies outside the raster.
+      return np.empty((max(row1 - row0, 0), max(col1 - col0, 0)),
+                      dtype=self.dtype)
+    bh, bw = self.block_shape
+    block_rows = range(row0 // bh, (max(row1, row0 + 1) - 1) // bh + 1)
+    block_cols = range(col0 // bw, (max(col1, col0 + 1) - 1) // bw + 1)
+    if len(block_rows) == 1 and len(block_cols) == 1:
+      i, j = block_rows[0], block_cols[0]
+      return self.blocks[i, j][row0 - i * bh:row1 - i * bh,
+                               col0 - j * bw:col1 - j * bw]
+
+    window = np.empty((row1 - row0, col1 - col0), dtype=self.dtype)
+    for i in block_rows:
+      for j in block_cols:
+        block = self.cache.get((self.token, i, j),
+                               lambda: np.array(self.blocks[i, j]))
+        r0, r1 = max(row0, i * bh), min(row1, (i + 1) * bh)
+        c0, c1 = max(col0, j * bw), min(col1, (j + 1) * bw)
+        window[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = \
+          block[r0 - i * bh:r1 - i * bh, c0 - j * bw:c1 - j * bw]
+    return window
+
+  def __getitem__(self, key):
+    rows, cols = key
+    row0, row1, _ = rows.indices(self.shape[0])
+    col0, col1, _ = cols.indices(self.shape[1])
+    return self.read(row0, row1, col0, col1)
+
+  def read_bounds(self, west, south, east, north):
+    """Read the smallest window covering the given bounds. Returns the window
+    and the coordinates of its northwest corner."""
+    # Rounding first so that bounds on pixel edges are not thrown a pixel out
+    # by floating point error.
+    rows = np.round((self.north - np.array([north, south])) / self.res, 6)
+    cols = np.round((np.array([west, east]) - self.west) / self.res, 6)
+    row0, row1 = int(np.floor(rows[0])), int(np.ceil(rows[1]))
+    col0, col1 = int(np.floor(cols[0])), int(np.ceil(cols[1]))
+    row0, col0 = max(row0, 0), max(col0, 0)
+    window = self.read(row0, row1, col0, col1)
+    return (window, self.west + col0 * self.res,
+            self.north - row0 * self.res)
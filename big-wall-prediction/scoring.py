@@ -0,0 +1,74 @@
+"""Rank candidate cliffs by a fitted model without scoring and sorting them all
+at once. Candidates are read in chunks, each chunk is scored, and only the
+best k rows seen so far are kept, picked with np.argpartition. Memory depends
+on the chunk size and k, not on the number of candidates, and the running
+ranking is available after every chunk.
+
+Usage:
+  for ranking in stream_top_k(reg.predict, unexplored, k=20):
+    print(ranking)  # best 20 of the chunks scored so far
+"""
+
+import numpy as np
+import pandas as pd
+
+TOP_K = 1000
+CHUNK_ROWS = 50000
+
+# Columns that are not features, and the columns of a ranking.
+DROP_COLUMNS = ['latitude', 'longitude', 'mp_score']
+RANKING_COLUMNS = ['latitude', 'longitude', 'height', 'mp_score',
+                   'predicted_score']
+
+
+def iter_chunks(candidates, chunk_rows=CHUNK_ROWS):
+  """Split a DataFrame into chunks of rows. Here candidates can also be an
+  iterable of DataFrames, such as pd.read_csv(..., chunksize=n)."""
+  if isinstance(candidates, pd.DataFrame):
+    for start in range(0, len(candidates), chunk_rows):
+      yield candidates.iloc[start:start + chunk_rows]
+  else:
+    yield from candidates
+
+
+def best_rows(scores, k):
+  """Get the positions of the k highest scores, highest first."""
+  if len(scores) > k:
+    best = np.argpartition(-scores, k - 1)[:k]
+  else:
+    best = np.arange(len(scores))
+  return best[np.argsort(-scores[best], kind='stable')]
+
+
+def to_meters(ranking):
+  """Undo the scaling of height in prepare_big_wall_data.py."""
+  return ranking.assign(height=ranking.height * 1000)
+
+
+def stream_top_k(predict, candidates, k=TOP_K, chunk_rows=CHUNK_ROWS):
+  """Score candidates chunk by chunk with predict, which maps a DataFrame of
+  features to an array of scores. After each chunk, yields a DataFrame of the
+  k best candidates so far with RANKING_COLUMNS, best first, and height in
+  meters."""
+  ranking = None
+  for chunk in iter_chunks(candidates, chunk_rows):
+    if not len(chunk):
+      continue
+    scores = np.asarray(predict(chunk.drop(columns=DROP_COLUMNS)),
+                        dtype=np.float64).reshape(-1)
+    best = best_rows(scores, k)
+    rows = chunk[RANKING_COLUMNS[:-1]].iloc[best].assign(
+      predicted_score=scores[best])
+    if ranking is not None:
+      rows = pd.concat([ranking, rows], ignore_index=True)
+      rows = rows.iloc[best_rows(rows.predicted_score.values, k)]
+    ranking = rows.reset_index(drop=True)
+    yield to_meters(ranking)
+
+
+def top_k(predict, candidates, k=TOP_K, chunk_rows=CHUNK_ROWS):
+  """Get the final ranking of stream_top_k()."""
+  ranking = pd.DataFrame(columns=RANKING_COLUMNS)
+  for ranking in stream_top_k(predict, candidates, k, chunk_rows):
+    pass
+  return ranking
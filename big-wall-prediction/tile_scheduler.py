@@ -0,0 +1,104 @@
+"""Run a per-rectangle job over the grid of rectangles from
+gather_big_wall_data.py in a local process pool. Each rectangle's results are
+written to their own shard on disk as soon as they are ready. A restarted run
+skips rectangles whose shards already exist, and the shards are combined into
+one CSV at the end.
+
+By itself, rectangle_grid() covers the whole bounding box of the region,
+including ocean, Canada and Mexico, while the gather script only keeps the
+rectangles that touch the US. Every rectangle passed to run_tiles() costs a
+call to the work function, so pass a region_filter, such as
+gather_big_wall_data.usa_rectangles, or filter the grid before running it.
+
+The work function takes a rectangle (west, south, east, north) and returns a
+DataFrame of cliffs; it could search a local elevation raster with
+local_cliffs.py, or call out to earth engine. It must be defined at the top
+level of a module so that it can be sent to the worker processes.
+
+Usage:
+  rectangles = rectangle_grid(region_filter=usa_rectangles)
+  done, failed = run_tiles(work, rectangles, 'data/shards')
+  df = merge_shards('data/shards',
+                    'data/big_wall_data_steepness_70_height_80m.csv')
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+# The region searched in gather_big_wall_data.py.
+X0, X1, DX = -125, -102, 0.25
+Y0, Y1, DY = 31, 49, 0.25
+
+
+def rectangle_grid(x0=X0, x1=X1, dx=DX, y0=Y0, y1=Y1, dy=DY,
+                   region_filter=None):
+  """Build the list of rectangles (west, south, east, north) covering the
+  region. Corners are computed from integer steps to avoid drift. When given,
+  region_filter takes the list of rectangles and returns the ones to keep."""
+  nx = int(round((x1 - x0) / dx))
+  ny = int(round((y1 - y0) / dy))
+  rectangles = [(round(x0 + i * dx, 6), round(y0 + j * dy, 6),
+                 round(x0 + (i + 1) * dx, 6), round(y0 + (j + 1) * dy, 6))
+                for i in range(nx) for j in range(ny)]
+  if region_filter is not None:
+    rectangles = list(region_filter(rectangles))
+  return rectangles
+
+
+def shard_path(shard_dir, rectangle):
+  """Get the path of the shard holding the results for a rectangle."""
+  west, south = rectangle[:2]
+  return os.path.join(shard_dir, 'tile_{:.6f}_{:.6f}.csv'.format(west, south))
+
+
+def run_tile(work, rectangle, path):
+  """Run work on one rectangle and write its shard. The shard is written to a
+  temporary file first, so a crash never leaves a partial shard behind."""
+  results = work(rectangle)
+  if results is None:
+    results = pd.DataFrame()
+  tmp_path = path + '.tmp'
+  results.to_csv(tmp_path, header=True, index=False)
+  os.replace(tmp_path, path)
+  return path
+
+
+def run_tiles(work, rectangles, shard_dir, processes=None):
+  """Run work over every rectangle without a shard in shard_dir. Returns the
+  list of rectangles finished in this run and a dict mapping each failed
+  rectangle to its exception. Failed rectangles are retried on the next run."""
+  os.makedirs(shard_dir, exist_ok=True)
+  todo = [r for r in rectangles if not os.path.exists(shard_path(shard_dir, r))]
+  print('Running {} of {} rectangles.'.format(len(todo), len(rectangles)))
+
+  done, failed = [], {}
+  with ProcessPoolExecutor(max_workers=processes) as executor:
+    futures = {executor.submit(run_tile, work, r, shard_path(shard_dir, r)): r
+               for r in todo}
+    for future in as_completed(futures):
+      rectangle = futures[future]
+      try:
+        future.result()
+        done.append(rectangle)
+      except Exception as error:
+        failed[rectangle] = error
+        print('Failed on rectangle {}: {!r}'.format(rectangle, error))
+  return done, failed
+
+
+def merge_shards(shard_dir, output_path=None):
+  """Combine all shards into one DataFrame, optionally written to a CSV."""
+  frames = []
+  for path in sorted(glob.glob(os.path.join(shard_dir, 'tile_*.csv'))):
+    try:
+      frames.append(pd.read_csv(path))
+    except pd.errors.EmptyDataError:
+      # Rectangles without any cliffs leave an empty shard.
+      continue
+  df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+  if output_path is not None:
+    df.to_csv(output_path, header=True, index=False)
+  return df
@@ -0,0 +1,134 @@
+"""A numpy version of the contour extraction in mountain_slicer_server_side.py.
+The server-side script builds a masked image for every contour elevation,
+converts each one to vectors, and keeps the polygon containing the summit.
+Here a single sweep computes, for every pixel, the highest elevation at which
+it is still connected to the summit: the largest over all paths to the summit
+of the lowest elevation along the path. The region above the contour at any
+elevation that contains the summit is then just the set of pixels whose value
+is greater than that elevation, and its outer ring is traced directly.
+
+The sweep walks a maximum spanning tree of the pixel grid, where each edge is
+weighted by the lower of its two elevations; the lowest elevation on the tree
+path from a pixel to the summit is its connection level. As in
+reduceToVectors(), which defaults to eightConnected=True, pixels touching at a
+corner are connected, so the grid includes diagonal edges, and a ring can pass
+twice through a corner where the region is pinched to a diagonal.
+
+Usage:
+  dem = smooth_dem(dem)
+  contours = summit_contours(dem, west, north, res, (-110.869, 37.035),
+                             range(1800, 3110, 10))
+  df = local_fractal.contour_stats(contours)
+"""
+
+import numpy as np
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
+
+
+def smooth_dem(dem, radius=5, sigma=4):
+    """Smooth elevation like dem.convolve(ee.Kernel.gaussian(radius, sigma))."""
+    return ndimage.gaussian_filter(np.asarray(dem, dtype=np.float64), sigma,
+                                   mode='nearest', truncate=radius / sigma)
+
+
+def connection_levels(dem, summit_row, summit_col):
+    """For each pixel, get the highest elevation at which it is connected to
+    the summit pixel through eight-connected pixels above that elevation."""
+    index = np.arange(dem.size).reshape(dem.shape)
+    flat = dem.ravel()
+
+    # Horizontal, vertical, and both diagonal grid edges, weighted so that a
+    # minimum spanning tree maximizes the lower elevation of each edge.
+    # Weights must be positive for csgraph.
+    tails = np.concatenate([index[:, :-1].ravel(), index[:-1, :].ravel(),
+                            index[:-1, :-1].ravel(), index[:-1, 1:].ravel()])
+    heads = np.concatenate([index[:, 1:].ravel(), index[1:, :].ravel(),
+                            index[1:, 1:].ravel(), index[1:, :-1].ravel()])
+    lower = np.minimum(flat[tails], flat[heads])
+    weights = lower.max() - lower + 1
+    graph = sparse.coo_matrix((weights, (tails, heads)),
+                              shape=(dem.size, dem.size)).tocsr()
+    tree = csgraph.minimum_spanning_tree(graph)
+
+    summit = index[summit_row, summit_col]
+    _, predecessors = csgraph.breadth_first_order(
+        tree, summit, directed=False, return_predecessors=True)
+
+    # Taking the minimum elevation along each tree path to the summit by
+    # pointer jumping; after k rounds each pixel has seen 2 ** k ancestors.
+    pointer = np.where(predecessors < 0, np.arange(dem.size), predecessors)
+    level = flat.copy()
+    level[predecessors == -9999] = -np.inf
+    level[summit] = flat[summit]
+    while True:
+        level = np.minimum(level, level[pointer])
+        next_pointer = pointer[pointer]
+        if np.array_equal(next_pointer, pointer):
+            return level.reshape(dem.shape)
+        pointer = next_pointer
+
+
+# For each heading (east, south, west, north), the step taken from a pixel
+# corner, and the offsets from that corner to the pixels just ahead on the
+# left and right. Rows increase downward.
+STEPS = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+AHEAD_LEFT = [(-1, 0), (0, 0), (0, -1), (-1, -1)]
+AHEAD_RIGHT = [(0, 0), (0, -1), (-1, -1), (-1, 0)]
+
+
+def trace_outer_ring(mask):
+    """Trace the outer boundary of an eight-connected region along pixel
+    edges, keeping the region on the right. Returns the closed ring of
+    (row, col) pixel corners, keeping only the corners where the boundary
+    turns."""
+    # Padding so that pixel (r, c) of mask is padded[r + 1, c + 1].
+    padded = np.pad(mask, 1)
+
+    # The top-left corner of the first pixel in raster order is on the outer
+    # ring, and the ring leaves it heading east.
+    first = int(np.argmax(mask))
+    start = divmod(first, mask.shape[1])
+    ring = [start]
+    row, col = start
+    heading = 0
+    while True:
+        row += STEPS[heading][0]
+        col += STEPS[heading][1]
+        if (row, col) == start:
+            break
+        dr, dc = AHEAD_LEFT[heading]
+        if padded[row + dr + 1, col + dc + 1]:
+            # Also taken when the pixel ahead on the right is not in the
+            # region; the pixel ahead on the left then touches the current
+            # pixel diagonally, which counts as connected.
+            heading = (heading + 3) % 4
+            ring.append((row, col))
+            continue
+        dr, dc = AHEAD_RIGHT[heading]
+        if not padded[row + dr + 1, col + dc + 1]:
+            heading = (heading + 1) % 4
+            ring.append((row, col))
+    ring.append(start)
+    return np.array(ring)
+
+
+def summit_contours(dem, west, north, res, summit, levels):
+    """Get the ring of the contour enclosing the summit at each level. Here
+    summit is a (longitude, latitude) pair. Returns (level, vertices) pairs,
+    with vertices as (longitude, latitude) arrays, for every level below the
+    summit; levels at or above it are skipped."""
+    summit_row = int((north - summit[1]) / res)
+    summit_col = int((summit[0] - west) / res)
+    level_map = connection_levels(dem, summit_row, summit_col)
+
+    contours = []
+    for level in sorted(levels):
+        region = level_map > level
+        if not region.any():
+            continue
+        ring = trace_outer_ring(region)
+        vertices = np.stack([west + ring[:, 1] * res, north - ring[:, 0] * res],
+                            axis=1)
+        contours.append((level, vertices))
+    return contours
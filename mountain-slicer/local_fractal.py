@@ -0,0 +1,107 @@
+"""A numpy version of the contour statistics in mountain_slicer_server_side.py.
+The server-side perimeter_at_scale() builds a new polygon for every shift at
+every scale. Here the sub-polygon edges for all shifts and all scales of a
+contour are gathered into index arrays and measured with a single vectorized
+geodesic distance call.
+
+Vertices are arrays of shape (n, 2) holding (longitude, latitude) pairs, as in
+the coordinates of an ee.Geometry.Polygon.
+"""
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371008.8  # mean radius, in meters
+
+
+def geodesic_distance(a, b):
+    """Great circle distance in meters between arrays of (long, lat) points."""
+    lon1, lat1 = np.radians(a[..., 0]), np.radians(a[..., 1])
+    lon2, lat2 = np.radians(b[..., 0]), np.radians(b[..., 1])
+    h = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def perimeters_at_scales(vertices, scales):
+    """Calculate the average perimeter of the sub-polygons obtained by keeping
+    every scale-th vertex, for each scale at once. As in the server-side
+    version, the sub-polygon with shift k keeps vertices k, k + scale, ... up
+    to the last vertex, and is closed back to vertex k."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    end = len(vertices) - 1
+    scales = np.asarray(scales, dtype=np.int64)
+
+    # Edges between consecutive kept vertices. For a given scale, the edge
+    # from vertex i to i + scale belongs to the sub-polygon with shift
+    # i % scale, so every i from 0 to end - scale is used exactly once.
+    num_edges = np.maximum(end + 1 - scales, 0)
+    scale_index = np.repeat(np.arange(len(scales)), num_edges)
+    starts = np.arange(num_edges.sum()) - np.repeat(
+        np.cumsum(num_edges) - num_edges, num_edges)
+    ends = starts + scales[scale_index]
+
+    # Closing edges, from the last kept vertex back to the first.
+    closing_scale_index = np.repeat(np.arange(len(scales)), scales)
+    shifts = np.arange(scales.sum()) - np.repeat(
+        np.cumsum(scales) - scales, scales)
+    step = scales[closing_scale_index]
+    lasts = shifts + step * ((end - shifts) // step)
+
+    a = np.concatenate([starts, lasts])
+    b = np.concatenate([ends, shifts])
+    distance = geodesic_distance(vertices[a], vertices[b])
+    totals = np.bincount(np.concatenate([scale_index, closing_scale_index]),
+                         weights=distance, minlength=len(scales))
+    return totals / scales
+
+
+def perimeter_at_scale(vertices, scale):
+    """Calculate the average perimeter of the sub-polygons obtained by sampling
+    vertices at specified scale."""
+    return perimeters_at_scales(vertices, [scale])[0]
+
+
+def fractal_dimension(vertices):
+    """Calculate the fractal dimension of a polygon by taking a linear
+    regression of perimeters at different scaling levels."""
+    # Need each list of sub-vertices to have at least three vertices; see the
+    # server-side version for the derivation of this bound.
+    exponent_bound = int(np.log2(len(vertices)) - np.log2(3))
+    if exponent_bound < 2:
+        return np.nan
+    exponents = np.arange(1, exponent_bound + 1)
+    log_perimeters = np.log(perimeters_at_scales(vertices, 2 ** exponents))
+
+    # Fitting a linear model to the log-log data, pairing the perimeters with
+    # the exponents in reverse order as the server-side version does.
+    slope = np.polyfit(exponents[::-1], log_perimeters, 1)[0]
+    return slope + 1
+
+
+def polygon_area(vertices):
+    """Area in square meters of a polygon on a spherical earth."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    lon = np.radians(vertices[:, 0])
+    lat = np.radians(vertices[:, 1])
+    lon_next, lat_next = np.roll(lon, -1), np.roll(lat, -1)
+    total = np.sum((lon_next - lon) * (2 + np.sin(lat) + np.sin(lat_next)))
+    return abs(total) * EARTH_RADIUS ** 2 / 2
+
+
+def get_stats(elevation, vertices):
+    """Get area, perimeter, and fractal dimension of polygon."""
+    # Calculating perimeter at second-most zoomed-in level to avoid pixel
+    # noise, as the server-side version does.
+    return {'elevation': int(elevation),
+            'area': int(polygon_area(vertices)),
+            'perimeter': int(perimeter_at_scale(vertices, 2)),
+            'fractal_dim': float(fractal_dimension(vertices))}
+
+
+def contour_stats(contours):
+    """Build a table like navajo.csv from (elevation, vertices) pairs."""
+    return pd.DataFrame([get_stats(elevation, vertices)
+                         for elevation, vertices in contours],
+                        columns=['elevation', 'area', 'perimeter',
+                                 'fractal_dim'])
@@ -0,0 +1,83 @@
+"""A batched version of gradDescent() from slope-finder.js. The app takes each
+step of a path with four reduceRegion() calls to the server. Here the terrain
+layers are built once (see terrain_layers.py) and thousands of seed points
+advance together, sampling the layers with vectorized bilinear interpolation.
+This makes it possible to precompute fall lines for a whole zone.
+
+Usage:
+  layers = build_layers(dem, west, north, res)
+  tracks = grad_descent(layers, longitudes, latitudes, num_steps=100)
+  data_table = build_data_table(tracks)
+"""
+
+import numpy as np
+
+NUM_STEPS = 100
+STEP_SIZE = 0.0002  # in degrees, as in slope-finder.js
+FEET_PER_METER = 3.28084
+
+
+def bilinear(layer, rows, cols):
+    """Sample a layer at fractional pixel positions, measured so that the
+    center of pixel (r, c) is at (r, c). Positions off the layer give NaN."""
+    num_rows, num_cols = layer.shape
+    inside = (rows >= 0) & (rows <= num_rows - 1) & \
+        (cols >= 0) & (cols <= num_cols - 1)
+    rows = np.where(inside, rows, 0)
+    cols = np.where(inside, cols, 0)
+    r0 = np.minimum(np.floor(rows).astype(np.int64), num_rows - 2)
+    c0 = np.minimum(np.floor(cols).astype(np.int64), num_cols - 2)
+    fr, fc = rows - r0, cols - c0
+    value = (layer[r0, c0] * (1 - fr) * (1 - fc) +
+             layer[r0, c0 + 1] * (1 - fr) * fc +
+             layer[r0 + 1, c0] * fr * (1 - fc) +
+             layer[r0 + 1, c0 + 1] * fr * fc)
+    return np.where(inside, value, np.nan)
+
+
+def grad_descent(layers, longitude, latitude, num_steps=NUM_STEPS,
+                 step_size=STEP_SIZE):
+    """Follow the smoothed aspect downhill from each seed point. Returns a dict
+    with the path of each seed (shape (num_steps + 1, seeds, 2), longitude
+    first) and the elevation in feet and slope in degrees sampled at each step
+    (shape (num_steps, seeds)). Seeds that leave the layers get NaN."""
+    x = np.array(longitude, dtype=np.float64, ndmin=1)
+    y = np.array(latitude, dtype=np.float64, ndmin=1)
+    path = np.empty((num_steps + 1, len(x), 2))
+    elevation = np.empty((num_steps, len(x)))
+    slope = np.empty((num_steps, len(x)))
+    path[0, :, 0], path[0, :, 1] = x, y
+
+    for step in range(num_steps):
+        rows = (layers.north - y) / layers.res - 0.5
+        cols = (x - layers.west) / layers.res - 0.5
+        elevation[step] = bilinear(layers.elevation, rows, cols) * \
+            FEET_PER_METER
+        slope[step] = bilinear(layers.slope, rows, cols)
+
+        # Taking a step in direction of gradient.
+        x = x + bilinear(layers.sin, rows, cols) * step_size
+        y = y + bilinear(layers.cos, rows, cols) * step_size
+        path[step + 1, :, 0], path[step + 1, :, 1] = x, y
+
+    return {'path': path, 'elevation': elevation, 'slope': slope}
+
+
+def build_data_table(tracks):
+    """Build the DataTable literal that buildDataTable() in slope-finder.js
+    passes to google charts: one elevation column and one slope tooltip
+    column per path."""
+    elevation, slope = tracks['elevation'], tracks['slope']
+    cols = [{'type': 'number'}]
+    for _ in range(elevation.shape[1]):
+        cols.append({'type': 'number'})
+        cols.append({'type': 'number', 'role': 'tooltip'})
+
+    rows = []
+    for j in range(elevation.shape[0]):
+        cells = [{'v': j}]
+        for e, s in zip(elevation[j].tolist(), slope[j].tolist()):
+            cells.append({'v': None if np.isnan(e) else e})
+            cells.append({'v': None if np.isnan(s) else s})
+        rows.append({'c': cells})
+    return {'cols': cols, 'rows': rows}
@@ -0,0 +1,173 @@
+"""A local backend for the map layers of slope-finder.js. Every slider change
+in the app rebuilds the target and tree layers from scratch with buildTarget()
+and buildTree(). Here slope, aspect, tree cover, and the elevation mask are
+quantized once into a pyramid of packed 16-bit codes. Any combination of the
+aspect, slope, and tree sliders then becomes a lookup table over the 65536
+possible codes, and a map tile is a single gather through that table. Rendered
+tiles are kept in an LRU cache.
+
+Each code packs, from the lowest bit:
+  11 bits: 2 degree slope bin * 36 + 10 degree aspect bin
+   1 bit:  elevation above LOWER_ELEVATION_THRESHOLD
+   4 bits: tree cover in tenths, rounded up
+
+Usage:
+  pyramid = SuitabilityPyramid.build(dem, layers.slope, tree, west, north, res)
+  rgba = pyramid.tile(z, x, y, aspect=180, slope=30, tree_threshold=50)
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from terrain_layers import METERS_PER_DEGREE, gaussian_smooth, terrain_products
+
+LOWER_ELEVATION_THRESHOLD = 7000 / 3.28084  # in meters
+SLOPE_BIN = 2  # degrees, matching the step of the slope slider
+ASPECT_BIN = 10  # degrees, matching the step of the aspect slider
+NUM_SLOPE_BINS = 46
+NUM_ASPECT_BINS = 36
+
+TILE_SIZE = 256
+NUM_LEVELS = 8
+CACHE_SIZE = 1024
+
+# Colors of the target layer, spread over slopes from 20 to 40 degrees, and of
+# the forest mask; opacity as in slope-finder.js.
+TARGET_PALETTE = np.array([[0, 128, 0], [255, 255, 0], [255, 0, 0]])
+TARGET_ALPHA = 128
+TREE_COLOR = [255, 255, 255, 153]
+
+
+def pack_codes(elevation, slope, aspect, tree):
+    """Quantize layers and pack them into 16-bit codes."""
+    slope_bin = np.clip(slope // SLOPE_BIN, 0, NUM_SLOPE_BINS - 1)
+    aspect_bin = (aspect // ASPECT_BIN) % NUM_ASPECT_BINS
+    tree_tenths = np.clip(np.ceil(tree / 10), 0, 10)
+    codes = slope_bin * NUM_ASPECT_BINS + aspect_bin
+    codes += (elevation > LOWER_ELEVATION_THRESHOLD) * 2 ** 11
+    codes += tree_tenths * 2 ** 12
+    return codes.astype(np.uint16)
+
+
+def pool(layer):
+    """Average over blocks of 2 x 2 pixels, dropping an odd last row or column."""
+    rows, cols = layer.shape[0] // 2 * 2, layer.shape[1] // 2 * 2
+    layer = layer[:rows, :cols]
+    return (layer[0::2, 0::2] + layer[0::2, 1::2] +
+            layer[1::2, 0::2] + layer[1::2, 1::2]) / 4
+
+
+class SuitabilityPyramid:
+    """Packed codes at several resolutions; level k has pixels 2 ** k times
+    as wide as level 0."""
+
+    def __init__(self, levels, west, north, res, cache_size=CACHE_SIZE):
+        self.levels = levels
+        self.west, self.north, self.res = west, north, res
+        self.cache_size = cache_size
+        self.tables = OrderedDict()
+        self.tiles = OrderedDict()
+
+    @classmethod
+    def build(cls, dem, slope, tree, west, north, res, num_levels=NUM_LEVELS):
+        """Build the pyramid from elevation, the smoothed slope layer, and raw
+        tree canopy cover, all on the same grid."""
+        dem = np.asarray(dem, dtype=np.float64)
+        slope = np.asarray(slope, dtype=np.float64)
+        # As in slope-finder.js, tree cover is smoothed but aspect is not.
+        tree = gaussian_smooth(tree, 5, 3)
+        aspect = np.radians(terrain_products(dem, north, res)[1])
+        sin, cos = np.sin(aspect), np.cos(aspect)
+
+        levels = []
+        for level in range(num_levels):
+            if level:
+                # Aspect is averaged on the circle through its sine and cosine.
+                dem, slope, tree, sin, cos = (
+                    pool(layer) for layer in (dem, slope, tree, sin, cos))
+            if not dem.size:
+                break
+            aspect = np.degrees(np.arctan2(sin, cos)) % 360
+            levels.append(pack_codes(dem, slope, aspect, tree))
+        return cls(levels, west, north, res)
+
+    def lookup_table(self, aspect, slope, tree_threshold=None):
+        """Get the RGBA color of every code for one setting of the sliders.
+        Here tree_threshold is None when forest masking is turned off."""
+        key = (aspect, slope, tree_threshold)
+        if key in self.tables:
+            self.tables.move_to_end(key)
+            return self.tables[key]
+
+        codes = np.arange(2 ** 16)
+        terrain = codes % 2 ** 11
+        slope_center = (terrain // NUM_ASPECT_BINS + 0.5) * SLOPE_BIN
+        aspect_center = (terrain % NUM_ASPECT_BINS + 0.5) * ASPECT_BIN
+        high = (codes >> 11) & 1 == 1
+        tree_tenths = codes >> 12
+
+        # The conditions of buildTarget(), evaluated at the center of each bin.
+        target = high & (slope_center > slope - 10) & \
+            (slope_center < slope + 10) & \
+            (np.cos(np.radians(aspect_center - aspect)) > 0.7)
+        position = np.clip((slope_center - 20) / 10, 0, 2)
+        lower = np.minimum(np.floor(position).astype(int), 1)
+        fraction = (position - lower)[:, np.newaxis]
+        colors = (1 - fraction) * TARGET_PALETTE[lower] + \
+            fraction * TARGET_PALETTE[lower + 1]
+
+        table = np.zeros((2 ** 16, 4), dtype=np.uint8)
+        table[target, :3] = np.round(colors[target])
+        table[target, 3] = TARGET_ALPHA
+        if tree_threshold is not None:
+            # The forest mask of buildTree() is drawn over the target layer.
+            table[tree_tenths > tree_threshold / 10] = TREE_COLOR
+
+        self.tables[key] = table
+        self._trim(self.tables)
+        return table
+
+    def tile(self, z, x, y, aspect, slope, tree_threshold=None):
+        """Render the XYZ (web mercator) tile (z, x, y) as an RGBA array of
+        shape (TILE_SIZE, TILE_SIZE, 4). Pixels off the pyramid are
+        transparent."""
+        key = (z, x, y, aspect, slope, tree_threshold)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        # Coordinates of the center of each tile pixel.
+        n = 2 ** z
+        offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        longitude = (x + offsets) / n * 360 - 180
+        latitude = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets)
+                                                          / n))))
+
+        # Picking the coarsest level whose pixels are no wider than the tile's.
+        tile_pixel = 2 * np.pi * 6378137 * np.cos(np.radians(latitude.mean())) \
+            / (n * TILE_SIZE)
+        base_pixel = self.res * METERS_PER_DEGREE
+        level = int(np.clip(np.floor(np.log2(max(tile_pixel / base_pixel, 1))),
+                            0, len(self.levels) - 1))
+        codes = self.levels[level]
+        res = self.res * 2 ** level
+
+        rows = np.floor((self.north - latitude) / res).astype(np.int64)
+        cols = np.floor((longitude - self.west) / res).astype(np.int64)
+        inside = ((rows >= 0) & (rows < codes.shape[0]))[:, np.newaxis] & \
+            ((cols >= 0) & (cols < codes.shape[1]))[np.newaxis, :]
+        rows = np.clip(rows, 0, codes.shape[0] - 1)
+        cols = np.clip(cols, 0, codes.shape[1] - 1)
+
+        table = self.lookup_table(aspect, slope, tree_threshold)
+        rgba = table[codes[rows[:, np.newaxis], cols[np.newaxis, :]]]
+        rgba[~inside] = 0
+        self.tiles[key] = rgba
+        self._trim(self.tiles)
+        return rgba
+
+    def _trim(self, cache):
+        """Drop least recently used entries beyond cache_size."""
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
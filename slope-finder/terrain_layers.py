@@ -0,0 +1,179 @@
+"""Local versions of the terrain layers built in slope-finder.js. The layers are
+computed once from an elevation array and can then be sampled as often as
+needed, for instance by grad_descent.py.
+
+For rasters too big to hold several full-size temporaries in memory,
+build_layers_chunked() works through the elevation array in overlapping
+chunks and writes each layer to a memory-mapped .npy file. Each chunk is read
+with a halo wide enough for every kernel applied to it, so the result matches
+build_layers() away from the edges of the raster.
+
+Rasters are in geographic coordinates with square pixels res degrees wide;
+row 0 lies along the northern edge (north) and column 0 along the western edge
+(west).
+"""
+
+import os
+
+import numpy as np
+from scipy import ndimage, signal
+
+EARTH_RADIUS = 6371008.8  # mean radius, in meters
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+SLOPE_RADIUS = 8  # radius of the circle kernel smoothing slope, in pixels
+ASPECT_RADIUS = 4  # radius of the circle kernel smoothing sin and cos
+RIDGE_RADIUS, RIDGE_SIGMA = 5, 3  # gaussian smoothing around the laplacian
+
+LAYER_NAMES = ['slope', 'sin', 'cos', 'laplacian']
+CHUNK_SIZE = 1024
+
+
+class TerrainLayers:
+    """Elevation and the smoothed slope and aspect layers of slope-finder.js,
+    all on the same grid."""
+
+    def __init__(self, elevation, slope, sin, cos, laplacian, west, north,
+                 res):
+        self.elevation = elevation
+        self.slope = slope
+        self.sin = sin
+        self.cos = cos
+        self.laplacian = laplacian
+        self.west, self.north, self.res = west, north, res
+
+    def ridges(self):
+        """Possible ridge lines, where the smoothed laplacian is very low."""
+        return self.laplacian < -1
+
+    def drainages(self):
+        """Possible drainages, where the smoothed laplacian is very high."""
+        return self.laplacian > 1
+
+
+def circle_kernel(radius):
+    """Normalized disk kernel, like ee.Kernel.circle({radius: radius})."""
+    offsets = np.arange(-radius, radius + 1)
+    kernel = (np.hypot(*np.meshgrid(offsets, offsets)) <= radius).astype(float)
+    return kernel / kernel.sum()
+
+
+def terrain_products(dem, north, res):
+    """Calculate slope and aspect in degrees like ee.Terrain.products(), from
+    the four neighbors of each pixel. Aspect is the downhill direction measured
+    clockwise from north."""
+    dem = np.asarray(dem, dtype=np.float64)
+    lat = north - (np.arange(dem.shape[0]) + 0.5) * res
+    dx = res * METERS_PER_DEGREE * np.cos(np.radians(lat))[:, np.newaxis]
+    dy = res * METERS_PER_DEGREE
+
+    padded = np.pad(dem, 1, mode='edge')
+    dz_east = (padded[1:-1, 2:] - padded[1:-1, :-2]) / (2 * dx)
+    dz_north = (padded[:-2, 1:-1] - padded[2:, 1:-1]) / (2 * dy)
+    slope = np.degrees(np.arctan(np.hypot(dz_east, dz_north)))
+    aspect = np.degrees(np.arctan2(-dz_east, -dz_north)) % 360
+    return slope, aspect
+
+
+def gaussian_kernel(radius, sigma):
+    """Normalized square kernel, like ee.Kernel.gaussian(radius, sigma)."""
+    offsets = np.arange(-radius, radius + 1)
+    weights = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    kernel = np.outer(weights, weights)
+    return kernel / kernel.sum()
+
+
+def gaussian_smooth(layer, radius, sigma):
+    """Smooth like convolve(ee.Kernel.gaussian(radius, sigma)). The kernel is
+    separable, so this takes two one-dimensional passes."""
+    offsets = np.arange(-radius, radius + 1)
+    weights = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    weights /= weights.sum()
+    layer = ndimage.correlate1d(np.asarray(layer, dtype=np.float64), weights,
+                                axis=0, mode='nearest')
+    return ndimage.correlate1d(layer, weights, axis=1, mode='nearest')
+
+
+def laplacian8_kernel():
+    """The kernel of ee.Kernel.laplacian8()."""
+    kernel = np.ones((3, 3))
+    kernel[1, 1] = -8
+    return kernel
+
+
+def ridge_kernel():
+    """The gaussian, laplacian8, gaussian chain of slope-finder.js fused into a
+    single kernel, so that it takes one convolution instead of three."""
+    gaussian = gaussian_kernel(RIDGE_RADIUS, RIDGE_SIGMA)
+    return signal.convolve(signal.convolve(gaussian, laplacian8_kernel()),
+                           gaussian)
+
+
+def smooth(layer, kernel):
+    """Convolve with an odd-sized kernel using the FFT, repeating edge values
+    beyond the layer."""
+    radius = kernel.shape[0] // 2
+    padded = np.pad(layer, radius, mode='edge')
+    return signal.oaconvolve(padded, kernel, mode='valid')
+
+
+# Widest neighborhood any layer depends on, including the one pixel used by
+# terrain_products().
+HALO = 1 + max(SLOPE_RADIUS, ASPECT_RADIUS, ridge_kernel().shape[0] // 2)
+
+
+def window_layers(dem, north, res):
+    """Compute every layer for an elevation array whose northern edge is at
+    latitude north. Returns a dict of layers keyed by LAYER_NAMES."""
+    dem = np.asarray(dem, dtype=np.float64)
+    slope, aspect = terrain_products(dem, north, res)
+    aspect = np.radians(aspect)
+    return {
+        # Smoothing slope aggressively to give a smooth path during descent.
+        'slope': smooth(slope, circle_kernel(SLOPE_RADIUS)),
+        # Aspect lives on a circle, so its sine and cosine are smoothed
+        # instead.
+        'sin': smooth(np.sin(aspect), circle_kernel(ASPECT_RADIUS)),
+        'cos': smooth(np.cos(aspect), circle_kernel(ASPECT_RADIUS)),
+        'laplacian': smooth(dem, ridge_kernel()),
+    }
+
+
+def build_layers(dem, west, north, res):
+    """Build the terrain layers for an elevation array held in memory."""
+    dem = np.asarray(dem, dtype=np.float64)
+    layers = window_layers(dem, north, res)
+    return TerrainLayers(dem, west=west, north=north, res=res, **layers)
+
+
+def build_layers_chunked(dem, west, north, res, out_dir,
+                         chunk_size=CHUNK_SIZE, dtype=np.float32):
+    """Build the terrain layers chunk by chunk, writing each one to
+    out_dir/<name>.npy. Here dem can be a numpy memmap. Peak memory depends on
+    chunk_size, not on the size of dem. Returns TerrainLayers backed by
+    read-only memmaps."""
+    os.makedirs(out_dir, exist_ok=True)
+    num_rows, num_cols = dem.shape
+    outputs = {name: np.lib.format.open_memmap(
+                   os.path.join(out_dir, name + '.npy'), mode='w+',
+                   dtype=dtype, shape=dem.shape)
+               for name in LAYER_NAMES}
+
+    for r0 in range(0, num_rows, chunk_size):
+        r1 = min(r0 + chunk_size, num_rows)
+        h0, h1 = max(r0 - HALO, 0), min(r1 + HALO, num_rows)
+        for c0 in range(0, num_cols, chunk_size):
+            c1 = min(c0 + chunk_size, num_cols)
+            g0, g1 = max(c0 - HALO, 0), min(c1 + HALO, num_cols)
+            layers = window_layers(dem[h0:h1, g0:g1], north - h0 * res, res)
+            for name, layer in layers.items():
+                outputs[name][r0:r1, c0:c1] = \
+                    layer[r0 - h0:r1 - h0, c0 - g0:c1 - g0]
+
+    for output in outputs.values():
+        output.flush()
+    del outputs
+    layers = {name: np.load(os.path.join(out_dir, name + '.npy'),
+                            mmap_mode='r')
+              for name in LAYER_NAMES}
+    return TerrainLayers(dem, west=west, north=north, res=res, **layers)